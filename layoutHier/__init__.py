@@ -1,5 +1,6 @@
 from .utils.pattern import *
 from .utils.helpers import maximal_periods
+from .utils.ingest import PolygonStore
 from .split_array_manager import SArray, SArrayManager
 from .project_array_manager import PArray, PArrayManager
 from .hierarchy_manager import HierarchyManager
@@ -7,64 +7,129 @@
 	Besides, some special care shoud be taken of arrays.
 	@add Hierarchy restore feature is added.
 """
+import gzip
+import multiprocessing
+import os
+import pickle
 import time
 
+import numpy as np
 import klayout.db as db
 from rtree import index
 
 from layoutHier.utils.structures import T1, T2, T3, T4, T5, T6, T7, T8
 from layoutHier.utils.pattern import *
-from layoutHier.utils.helpers import box_tuple, indexes_to_string, box_expand, inst_enlarge
+from layoutHier.utils.ingest import PolygonStore
+from layoutHier.utils.spatial import index_build, FixedWindow
+from layoutHier.utils.cache import ExpandCache
+from layoutHier.utils.helpers import box_tuple, box_closures, closure_rolls, insts_enlarge_rolls, \
+	groups_pack
+
+_prefetching = None		# manager forked into the workers of expansion prefetch
+# limits of the propagation of one seed, see HierarchyManager.unit_patterns_propogate
+propagateLimits = ('depth', 'patterns', 'instances', 'seconds')
+
+def _prefetch(args):
+	"""Worker of expansion prefetch, which calls the method named by args[0]
+	of the manager with the rest, see HierarchyManager.closures_prefetch."""
+	return getattr(_prefetching, args[0])(*args[1:])
 
 class HierarchyManager(object):
 	"""For flatten layout hierarchy, hierarchy is extracted through propagation
 	algorithm and can be restored back into the layout."""
 
-	def __init__(self, layout, polygonLib=PolygonLib([],{},0), root= Pattern()):
+	def __init__(self, layout, polygonLib=PolygonLib([],{},0), root= Pattern(),
+				 cacheBudget=256*1024*1024):
 		self.layout = layout
+		self.restoredLayout = None	# copy of the layout the hierarchy is restored in
 		self.polygonLib = polygonLib
 		self.patternRoot = root
+		self.expandCache = ExpandCache(cacheBudget)	# memoized box expansions
 
+		self.__topIndex = None	# index of the top cell parsed
 		self.__instList = []	# index => polygon instance
+		self.__elements = None	# index => packed 5-tuple of polygon
 		self.__polygonTree = index.Index()	# for polygon interaction index
+		self.searchWindow = FixedWindow()	# search window policy of enlargement
 		self.__unitLib = PatternLib([], {}, 0)
 		self.__globalLib = PatternLib([], {}, 0)
 		self.__largestLib = PatternLib([], {}, 0)
-
-	def layout_parse(self, layerIndex=0, merge=True, flatten=True):
-		topCell = self.layout.top_cell()
-		if flatten:
-			topCell.flatten(-1, False)
-		if merge:
-			topRegion = db.Region(topCell.begin_shapes_rec(layerIndex))
-			topRegion.merge(layerIndex)
-			topRegion.merged_semantics=0
-			iterator = topRegion.each_merged()
-		else:
-			iterator = topCell.each_shape(layerIndex)
-
-		for i, shape in enumerate(iterator):
-			box = shape.bbox()
-			if merge:
-				polygon = shape
-			else:
-				polygon = shape.polygon
-			vertexes = [(point.x, point.y) for point in polygon.each_point_hull()]
-			self.__instList.append(self.polygonLib.encode(box, vertexes))
-			self.__polygonTree.insert(i, (box.left, box.bottom, box.right, box.top))
+		self.__limits, self.__deadline = {}, None	# bounds of propagation
+		self.__done = []		# positions of unit patterns propagated
+		self.__coverage = None	# flags of polygons covered if pruned
+		self.truncated = []		# (seed position, limit hit) of seeds cut off, position None in expansion
+		self.phaseTimes = {}	# phase of unit_patterns_propogate => wall time in seconds
+
+	@classmethod
+	def from_file(cls, path, layer, window=None, **kwargs):
+		"""Load @param layer of the layout file only and parse it, polygons are
+		clipped at @param window if given. See @method layout_parse."""
+		layout, layerIndex = PolygonStore.layout_load(path, layer)
+		manager = cls(layout, PolygonLib([], {}, 0), Pattern(None, None, [], [], [], []))
+		manager.layout_parse(layerIndex, window=window, **kwargs)
+		return manager
+
+	def layout_parse(self, layerIndex=0, merge=True, flatten=False, deep=False,
+					 window=None, store=None, searchWindow=None):
+		"""Parse polygons of the layer. @param store is the PolygonStore ingested
+		before, so that one layer is parsed once for all managers. The layout is
+		left unchanged unless @param flatten is set, hierarchy is restored in a
+		flattened copy of it, see @method overlap_resolve.
+		@param searchWindow: window policy ('fixed' or 'density') of nearest
+		polygon search in instance enlargement, see window_config for the default."""
+		self.__topIndex = self.layout.top_cell().cell_index()
+		if store is None:
+			store = PolygonStore.from_layout(self.layout, layerIndex, merge, flatten,
+											 deep, window=window, polygonLib=self.polygonLib)
+		elif flatten:
+			self.layout.top_cell().flatten(-1, False)
+		self.__instList = store.instances()
+		self.__elements = store.elements()
+		self.polygonLib = store.polygon_lib(self.__instList)
+		self.__polygonTree = store.rtree()
+		self.searchWindow = store.search_window(searchWindow)
 
 		# pattern root
-		boxWorld = topCell.bbox()
-		inst = Instance(boxWorld, -1, -1, self.patternRoot)
+		inst = Instance(db.Box(store.world), -1, -1, self.patternRoot)
 		self.patternRoot.instList.append(inst)
 
 
-	def unit_patterns_propogate(self):
+	def unit_patterns_propogate(self, processes=1, prune=False, limits=None, deadline=None,
+								checkpoint=None, interval=1):
 		""""Derive unit patterns from polygon patterns according to definitions.
-		Than unit patterns are propogated."""
-
+		Than unit patterns are propogated. With @param processes more than one,
+		closures of polygon pattern instances are prefetched into @member
+		expandCache by a process pool first, see @method closures_prefetch,
+		unit patterns are derived from them and propagated serially. Wall
+		times of the phases are kept in @member phaseTimes.
+		Set @param prune to skip unit patterns whose polygons are covered by
+		largest patterns already, see @method seeds_uncovered.
+		@param limits: dict bounding the propagation of each seed by stack
+		'depth', 'patterns' popped, 'instances' enlarged and wall clock
+		'seconds', unbounded for missing or None values. A seed reaching any
+		of them is cut off, see @member truncated.
+		@param deadline: seconds the whole run may take. Once it is passed, the
+		seed propagated is cut off and the rest are skipped, so that largest
+		patterns confirmed so far form the hierarchy.
+		@param checkpoint: path the state is saved to once unit patterns are
+		derived and every @param interval (at least 1) seeds propagated, see
+		@method checkpoint_save and @method unit_patterns_resume."""
+
+		self.__bounds_set(limits, deadline, interval)
+		self.truncated, self.phaseTimes = [], {}
+		cache = self.expandCache
+		if processes > 1:
+			polygons = self.polygonLib.patternList
+			weights = [len(p) for p in polygons]
+			self.__prefetch('closures_prefetch',
+							groups_pack([[i] for i in range(len(polygons))], weights, processes))
+		end = time.time()
 		for pattern in self.polygonLib.patternList:
-			self.__unit_pattern_expand(self.__unitLib, pattern, self.__polygonTree, self.__instList)
+			if self.__deadline is not None and time.time() > self.__deadline:
+				self.truncated.append((None, 'deadline'))
+				break
+			self.__unit_pattern_expand(self.__unitLib, pattern, self.__polygonTree,
+									   self.__instList, self.__elements, cache)
 
 		# patterns with less instances has topper priority
 		temp = []
@@ -73,14 +138,156 @@ class HierarchyManager(object):
 				temp.append(pattern)
 		temp.sort(key = lambda x: len(x))
 		self.__unitLib.patternList = temp
+		self.phaseTimes['expand'] = time.time() - end
 
 		# reset visited to False
-		for inst in self.__instList:
-			inst.visited = False
+		self.__instList.visited_reset()
+		cache.visited_update()
+
+		self.__done = []
+		self.__coverage = np.zeros(len(self.__instList), dtype=bool) if prune else None
+		if checkpoint is not None:
+			self.checkpoint_save(checkpoint)
+		self.__seeds_propagate(checkpoint, interval)
+
+	def unit_patterns_resume(self, limits=None, deadline=None, checkpoint=None, interval=1):
+		"""Propagate unit patterns not propagated yet by the manager loaded
+		from a checkpoint, see @method checkpoint_load. Covered seeds are
+		skipped if @method unit_patterns_propogate pruned, and the other
+		parameters are the same. The result is the same as a run never
+		stopped without limits."""
+		self.__bounds_set(limits, deadline, interval)
+		self.__seeds_propagate(checkpoint, interval)
+
+	def __bounds_set(self, limits, deadline, interval):
+		"""Check and keep @param limits and @param deadline of propagation,
+		and check @param interval of checkpoints."""
+		limits = dict(limits or {})
+		for key in limits:
+			if key not in propagateLimits:
+				raise ValueError("Unknown propagation limit {}!".format(key))
+		if interval < 1:
+			raise ValueError("Checkpoint interval must be at least 1, got {}!".format(interval))
+		self.__limits = limits
+		self.__deadline = None if deadline is None else time.time() + deadline
+
+	def __seeds_propagate(self, checkpoint=None, interval=1):
+		"""Propagate unit patterns which are not done in order, and save the
+		state to @param checkpoint every @param interval seeds done."""
+		seeds, enlarged, cache = self.__unitLib.patternList, 0, self.expandCache
+		coverage, done = self.__coverage, set(self.__done)
+		end = time.time()
+		for i in (self.seeds_uncovered(seeds, coverage) if coverage is not None else range(len(seeds))):
+			if i in done:
+				continue
+			if self.__deadline is not None and time.time() > self.__deadline:
+				self.truncated.append((i, 'deadline'))
+				break
+			n, limit = self.__propagate(self.__largestLib, self.__globalLib, seeds[i], self.patternRoot,
+					self.__instList, self.__elements, self.__polygonTree, cache=cache, coverage=coverage,
+					window=self.searchWindow, limits=self.__limits, deadline=self.__deadline)
+			enlarged += n
+			if limit is not None:
+				self.truncated.append((i, limit))
+			self.__done.append(i)
+			if checkpoint is not None and len(self.__done) % interval == 0:
+				self.checkpoint_save(checkpoint)
+		if checkpoint is not None and len(self.__done) % interval != 0:
+			self.checkpoint_save(checkpoint)
+		self.phaseTimes['propagate'] = self.phaseTimes.get('propagate', 0) + time.time() - end
+		print("Enlarged instances: {}, expand cache: {}".format(enlarged, cache))
+		if self.truncated:
+			print("Seeds cut off by limits: {}".format(len(self.truncated)))
+
+	def checkpoint_save(self, path):
+		"""Save the state of propagation to @param path as a compressed pickle:
+		polygon instances with visited flags, packed polygons, the libraries,
+		the pattern tree and the seeds done. The layout, spatial indexes and
+		@member expandCache are not saved. The file is replaced at once, so
+		the former checkpoint is kept if writing fails."""
+		state = {'polygonLib': self.polygonLib, 'root': self.patternRoot, 'instList': self.__instList,
+				 'elements': self.__elements, 'searchWindow': self.searchWindow,
+				 'unitLib': self.__unitLib, 'globalLib': self.__globalLib, 'largestLib': self.__largestLib,
+				 'done': self.__done, 'coverage': self.__coverage, 'truncated': self.truncated}
+		end, path = time.time(), os.fspath(path)
+		with gzip.open(path + '.tmp', 'wb', compresslevel=1) as f:
+			pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(path + '.tmp', path)
+		print("Checkpoint time is {}, seeds done: {}".format(time.time()-end, len(self.__done)))
+
+	@classmethod
+	def checkpoint_load(cls, path, layout, flatten=False):
+		"""Manager of the state saved by @method checkpoint_save. @param layout
+		is the layout parsed, which is flattened if @param flatten is set as
+		layout_parse does."""
+		with gzip.open(path, 'rb') as f:
+			state = pickle.load(f)
+		manager = cls(layout, state['polygonLib'], state['root'])
+		manager.__topIndex = layout.top_cell().cell_index()
+		if flatten:
+			layout.top_cell().flatten(-1, False)
+		manager.__instList = state['instList']
+		manager.__elements = state['elements']
+		manager.__polygonTree = index_build(manager.__instList.bbox, phase='polygon')
+		manager.searchWindow = state['searchWindow']
+		manager.__unitLib = state['unitLib']
+		manager.__globalLib = state['globalLib']
+		manager.__largestLib = state['largestLib']
+		manager.__done, manager.__coverage = state['done'], state['coverage']
+		manager.truncated = state['truncated']
+		return manager
 
-		for pattern in self.__unitLib.patternList:
-			self.__propagate(self.__largestLib, self.__globalLib, pattern,
-					self.patternRoot, self.__instList, self.__polygonTree)
+	@staticmethod
+	def seeds_uncovered(seeds, coverage):
+		"""Yield positions of unit patterns @param seeds in their order,
+		skipping those whose polygons are all covered by the largest patterns
+		found already. The order is not changed, so the hierarchy restored is
+		the same as without skipping.
+		@param coverage: flags of polygons covered, updated as each yielded
+		seed is propagated."""
+		skipped = 0
+		for i, seed in enumerate(seeds):
+			rows = [inst.row for inst in seed.polygonList]
+			if rows and coverage[rows].all():
+				skipped += 1
+			else:
+				yield i
+		print("Unit patterns skipped as covered: {}".format(skipped))
+
+	def __prefetch(self, method, groups):
+		"""Call @param method of the manager for each of @param groups in forked
+		processes sharing the polygon store, and merge expansions cached by them
+		into @member expandCache."""
+		global _prefetching
+		if len(groups) < 2:
+			return
+		try:
+			context = multiprocessing.get_context('fork')
+		except ValueError:		# no shared memory for workers
+			return
+		end, _prefetching = time.time(), self
+		try:
+			with context.Pool(len(groups)) as pool:
+				for items in pool.imap(_prefetch, [(method, group, self.expandCache.budget)
+												   for group in groups]):
+					self.expandCache.merge(items)
+		finally:
+			_prefetching = None
+		self.phaseTimes['prefetch'] = time.time() - end
+		print("Prefetch time of {} is {} for {} groups".format(method, time.time()-end, len(groups)))
+
+	def closures_prefetch(self, positions, budget):
+		"""Closures and rolls of all instances of polygon patterns at @param
+		positions, which @method __unit_pattern_expand looks up in the cache.
+		They do not depend on visited flags, unit patterns are not encoded.
+		@param budget: memory budget of the expansions cached in bytes.
+		@return: items of the expansions cached, see ExpandCache.items."""
+		cache = ExpandCache(budget)
+		for i in positions:
+			seeds = [inst.bbox for inst in self.polygonLib.patternList[i].instList]
+			for box, regionList in box_closures(self.__polygonTree, seeds, cache):
+				closure_rolls(box, regionList, self.__elements, cache)
+		return cache.items()
 
 	def visualize(self, split=True):
 		regions = []
@@ -112,7 +319,9 @@ class HierarchyManager(object):
 
 	def overlap_resolve(self, flowUp=False, restore=True):
 		"""Overlapping patterns within one level including the self_overlapping and
-		the cross_overlapping are resolved to ensure proper hierarchy."""
+		the cross_overlapping are resolved to ensure proper hierarchy. With
+		@param restore, the hierarchy is restored in @member restoredLayout,
+		and the cell of the pattern root is returned."""
 
 		patternRoot, largestLib = self.patternRoot, self.__largestLib
 		largestLib.pattern_rtree_construct()
@@ -122,7 +331,7 @@ class HierarchyManager(object):
 			# self-overlapping patterns resolve
 			for p0 in largestLib.patternList:
 				for inst in p0.instList:
-					self_overlap = list(p0.rtree.intersection(box_tuple(inst.bbox)))
+					self_overlap = p0.instList.intersection(box_tuple(inst.bbox))
 					if len(self_overlap) > 1:
 						delete[p0] = 0
 						break
@@ -151,14 +360,16 @@ class HierarchyManager(object):
 				if pattern in delete:
 					continue
 
-				childTree = index.Index()
+				ids, boxes = [], []
 				boxP = pattern.instList[0].bbox	# one instance for one box
 				for i, p0 in enumerate(pattern.childPatterns):
 					if p0 in delete:   # patterns might be processed before
 						continue
 					for inst in p0:
 						if inst.bbox.inside(boxP):
-							childTree.insert(i, box_tuple(inst.bbox))
+							ids.append(i)
+							boxes.append(box_tuple(inst.bbox))
+				childTree = index_build(boxes, ids)
 
 				i, keepTemp = 0, []
 				for p in pattern.childPatterns:
@@ -219,26 +430,42 @@ class HierarchyManager(object):
 			return self.__hierarchy_restore()
 
 	@staticmethod
-	def __propagate(largestLib, globalLib, patternSeed, patternRoot, instList, rtree,
-					reduction=False, threshold=200):
+	def __propagate(largestLib, globalLib, patternSeed, patternRoot, instList, elements, rtree,
+					reduction=False, cache=None, coverage=None, window=None, limits=None, deadline=None):
 		""""propagate one seed pattern to several repeating patterns and filter
 		Largest Repeating pattern out.Further, pattern relation are recorded for
 		hierarchy reconstruction. Set @param reduction to induce expansion
-		direction reduction."""
+		direction reduction. Expansions are memoized in @param cache. Codes of
+		enlarged instances are hashed from their instances incrementally.
+		Polygons inside largest patterns found are flagged in @param coverage.
+		Nearest polygons are searched within windows of @param window policy.
+		Propagation stops at @param limits or the time @param deadline, see
+		@method unit_patterns_propogate, and the seed is not marked as visited.
+		@return: (number of instances enlarged, limit hit or None)."""
 
 		stack = [patternSeed]
 		localLib = PatternLib([], {}, 0)
 		visitedFlag = True
+		enlarged, popped, limit = 0, 0, None
+		limits = limits or {}
+		seconds = limits.get('seconds')
+		seedDeadline = None if seconds is None else time.time() + seconds
 		while(stack):
 			print("Stack depth: %d" % len(stack))
+			limit = HierarchyManager.__limit_hit(limits, len(stack), popped, enlarged, seedDeadline, deadline)
+			if limit is not None:
+				visitedFlag = False
+				break
 			patternTop = stack.pop()
+			popped += 1
 			n = len(patternTop)
+			enlarged += n
 			patternSet = PatternLib([], {}, 0) # interim pattern library for one pattern propagation process
-			incremental = True if len(patternTop.code[0])>threshold else False
-			for inst in patternTop.instList:
-				stringList, boxList = inst_enlarge(inst.bbox, instList, rtree, incremental)
-				for string,box in zip(stringList, boxList):
-					patternSet.encode(string, box)
+			for codeList, boxList, rollsList in insts_enlarge_rolls(
+					[inst.bbox for inst in patternTop.instList], [inst.rolls for inst in patternTop.instList],
+					instList, elements, rtree, cache, window):
+				for code, box, rolls in zip(codeList, boxList, rollsList):
+					patternSet.encode(code, box, rolls)
 
 			patternL, count = [], 0
 			for pattern in patternSet.patternList:
@@ -292,31 +519,53 @@ class HierarchyManager(object):
 				largestLib.patternList.append(patternTop)
 				if rootFlag:
 					patternRoot.childPatterns.append(patternTop)
+				if coverage is not None:
+					for indexes in rtree.intersection_batch(patternTop.instList.boxes()):
+						coverage[indexes] = True
 		if visitedFlag:
 			for polyInst in patternSeed.polygonList:
 				polyInst.visited = True
+			if cache is not None:
+				cache.visited_update()
+		return enlarged, limit
 
 	@staticmethod
-	def __unit_pattern_expand(UnitLib, polygonPattern, rtree, instList):
-		""""Expand from polygon seed to complete region without cutting any polygons."""
+	def __limit_hit(limits, depth, popped, enlarged, seedDeadline, deadline):
+		"""Name of the first limit of one seed propagation reached, None if
+		there is none, see @method unit_patterns_propogate."""
+		if limits.get('depth') is not None and depth > limits['depth']:
+			return 'depth'
+		if limits.get('patterns') is not None and popped >= limits['patterns']:
+			return 'patterns'
+		if limits.get('instances') is not None and enlarged >= limits['instances']:
+			return 'instances'
+		if seedDeadline is not None and time.time() > seedDeadline:
+			return 'seconds'
+		if deadline is not None and time.time() > deadline:
+			return 'deadline'
+		return None
+
+	@staticmethod
+	def __unit_pattern_expand(UnitLib, polygonPattern, rtree, instList, elements, cache=None):
+		""""Expand from polygon seed to complete region without cutting any polygons.
+		@param elements: packed 5-tuples of polygons, see PolygonStore.elements."""
 
 		patternNum = UnitLib.patternCount
 		visitedList = list()       		  	#waiting list to be marked as visited
 		exclusive = dict()
 		special = list()                    #instance of former pattern
 
-		for inst in polygonPattern.instList:
-			if not inst.visited:  			#inst not being included by unit pattern
-				box = db.Box(inst.bbox)
-				box1, regionList = box_expand(box, instList, rtree)
-				inst1 = UnitLib.encode( indexes_to_string(regionList, instList), box)
-				idx = inst1.pid - patternNum
-				if idx < 0:
-					special.extend(regionList)
-				elif len(visitedList) > idx:
-					visitedList[idx].extend(regionList)
-				else:
-					visitedList.append(regionList)
+		#inst not being included by unit pattern
+		seeds = [inst.bbox for inst in polygonPattern.instList if not inst.visited]
+		for box, regionList in box_closures(rtree, seeds, cache):
+			inst1 = UnitLib.encode(elements[regionList], box, closure_rolls(box, regionList, elements, cache))
+			idx = inst1.pid - patternNum
+			if idx < 0:
+				special.extend(regionList)
+			elif len(visitedList) > idx:
+				visitedList[idx].extend(regionList)
+			else:
+				visitedList.append(regionList)
 
 		total = UnitLib.patternCount - patternNum
 		for i in range(total):
@@ -331,6 +580,8 @@ class HierarchyManager(object):
 					instList[idx].visited = True
 		for idx in special:
 			instList[idx].visited = True
+		if cache is not None:
+			cache.visited_update()
 
 	@staticmethod
 	def __part_overlap_resolve(main, another, parent, delete, rtree, boxP):
@@ -375,7 +626,7 @@ class HierarchyManager(object):
 			# match instances
 			for inst in pattern:
 				for p in pattern.childPatterns:
-					children = list(p.rtree.intersection(box_tuple(inst.bbox)))
+					children = p.instList.intersection(box_tuple(inst.bbox))
 					p.instFlag_update(children)
 					inst.childInsts.extend(p.someInst(children))
 
@@ -392,9 +643,9 @@ class HierarchyManager(object):
 			instRoot.childInsts.extend([i for i in pattern.remainings()])
 		# FIXME: strategy like pattern overlapping resolve can be adopted
 		# possible overlaps resolve
-		delete, rtree = {}, index.Index()
-		for i, inst in enumerate(instRoot.childInsts):
-			rtree.insert(i, box_tuple(inst.bbox))
+		delete = {}
+		rtree = index_build([box_tuple(inst.bbox) for inst in instRoot.childInsts],
+							phase='instance')
 
 		for i, inst in enumerate(instRoot.childInsts):
 			if i in delete:
@@ -431,8 +682,14 @@ class HierarchyManager(object):
 
 	def __hierarchy_restore(self, layerIndex=0):
 		"""Restore hierarchy of flatten layout according to the instance tree
-		build before. The cell tree wild be built from bottom to the top."""
+		build before. The cell tree wild be built from bottom to the top. It is
+		built in a copy of the layout whose top cell is flattened, so that the
+		layout parsed is left unchanged."""
 		largestLib, patternRoot = self.__largestLib, self.patternRoot
+		layout = self.restoredLayout = self.layout.dup()
+		cellTop = layout.cell(self.__topIndex if self.__topIndex is not None
+							  else self.layout.top_cell().cell_index())
+		cellTop.flatten(-1, True)
 
 		patternRoot.instList[0].tid = T1  # maintain the integrity
 		patterns = [patternRoot]
@@ -440,7 +697,6 @@ class HierarchyManager(object):
 			patterns.extend(p.childPatterns)
 		patterns.reverse()
 
-		cellTop = self.layout.top_cell()
 		shapesTop = cellTop.shapes(layerIndex)
 		idx = 0
 		for p in patterns:	# from bottom to top
@@ -448,7 +704,7 @@ class HierarchyManager(object):
 				continue
 			idx += 1
 			# remove shapes from layout and build the cell(to T1 trans)
-			cell = self.layout.create_cell('Pattern-' + str(idx))
+			cell = layout.create_cell('Pattern-' + str(idx))
 			p.cell = cell
 			shapesCell = cell.shapes(layerIndex)
 			instT1 = p.instList[0]
@@ -515,7 +771,7 @@ class HierarchyManager(object):
 					is out of range[0-7].'.format(ci.tid.value))
 
 				instNew = db.CellInstArray(ci.pattern.cell.cell_index(), trans)
-				boxO = instNew.bbox(self.layout)
+				boxO = instNew.bbox(layout)
 				v0 = db.Vector(ci.bbox.left-boxO.left, ci.bbox.bottom-boxO.bottom)
 				instNew.transform(db.Trans(v0))
 				cell.insert(instNew)
@@ -14,12 +14,13 @@
 """
 
 import math
-import time
 
 from rtree import index
 import klayout.db as db
 
 from layoutHier.utils.pattern import *
+from layoutHier.utils.ingest import PolygonStore
+from layoutHier.utils.spatial import index_build
 from layoutHier.utils.helpers import box_merge
 
 __all__ = ["PArray", "PArrayManager"]
@@ -85,48 +86,19 @@ class PArrayManager(object):
 		self.bbox = box
 
 	@classmethod
-	def layout_to_array_proposals(cls, layout, layer=0, merge=True):
-		"""Construct ArrayManager object from a layout object."""
-		assert isinstance(layout, db.Layout)
+	def layout_to_array_proposals(cls, layout, layer=0, merge=True, store=None):
+		"""Construct ArrayManager object from a layout object.
+		@param store: PolygonStore ingested before, layout is parsed if None."""
+		if store is None:
+			store = PolygonStore.from_layout(layout, layer, merge)
 
-		polygonLib = PolygonLib([], {}, 0, type='polygon')
 		arrayProposals = []
 		arrayList = []
-		polygonList = []
-		polygonTree = index.Index()
-
-		# encode polygons of the layout
-		end = time.time()
-		try:
-			topCell = layout.top_cell()
-			topCell.flatten(-1, False)
-			boxWhole = topCell.bbox()
-			print("Flatten time is {}".format(time.time()-end))
-			end = time.time()
-		except:
-			print('Layout has nultiple top cell.')
-		if merge:
-			topRegion = db.Region(topCell.begin_shapes_rec(layer))
-			topRegion.merge(layer)
-			topRegion.merged_semantics=0
-			iterator = topRegion.each_merged()
-			print("Merge time is {}".format(time.time()-end))
-			end = time.time()
-		else:
-			iterator = topCell.each_shape(layer)
-
-		for i, shape in enumerate(iterator):
-			box = shape.bbox()
-			if merge:
-				polygon = shape
-			else:
-				polygon = shape.polygon
-			vertexes = [(point.x, point.y) for point in polygon.each_point_hull()]
-			polygonList.append(polygonLib.encode(box, vertexes))
-			polygonTree.insert(i, (box.left, box.bottom, box.right, box.top))
-
-		print("Encode time is {}".format(time.time()-end))
-		print("Polygon count is {}, area is {}".format(i, boxWhole.area()))
+		polygonList = store.instances()
+		polygonLib = store.polygon_lib(polygonList)
+		polygonTree = store.rtree()
+		boxWhole = db.Box(store.world)
+		print("Polygon count is {}, area is {}".format(len(store), boxWhole.area()))
 
 		# produce array proposals from polygon pattern
 		for pattern in polygonLib.patternList:
@@ -140,6 +112,13 @@ class PArrayManager(object):
 		arrayProposals.sort(key= lambda x: len(x), reverse=True)
 		return cls(arrayList, arrayProposals, polygonList, polygonTree, boxWhole)
 
+	@classmethod
+	def from_file(cls, path, layer, window=None, **kwargs):
+		"""Load @param layer of the layout file only, clip at @param window and
+		construct ArrayManager. See PolygonStore.from_layout for @param kwargs."""
+		store = PolygonStore.from_file(path, layer, window, **kwargs)
+		return cls.layout_to_array_proposals(None, store=store)
+
 	def untouching(self, proposal):
 		"""Assert array proposals are valid or not according to touching principle."""
 
@@ -194,6 +173,13 @@ class PArrayManager(object):
 
 		self.arrayList = realArrays
 
+	@staticmethod
+	def _element_box(array, x0, y0):
+		"""Box of element (@param x0, @param y0) of @param array."""
+		l = array.bbox.left + array.periodX*x0
+		b = array.bbox.bottom + array.periodY*y0
+		return (l, b, l+array.periodX, b+array.periodY)
+
 	def array_check_linear(self):
 		"""Check elements in array one by one to make sure they are the
 		same. Attentionally, boundary elements are treated different."""
@@ -204,11 +190,8 @@ class PArrayManager(object):
 			area = array.periodX* array.periodY
 			# elements inside
 			elesInside = [(x,y) for x in range(1,sizex-1) for y in range(1,sizey-1)]
-			for x0, y0 in elesInside:
-				l = array.bbox.left + array.periodX*x0
-				b = array.bbox.bottom + array.periodY*y0
-				r, t = l+array.periodX, b + array.periodY
-				idx = list(self.polygonTree.intersection((l, b, r, t)))
+			boxes = [self._element_box(array, x0, y0) for x0, y0 in elesInside]
+			for idx in self.polygonTree.intersection_batch(boxes):
 				instString, ov = [], []
 				box = db.Box()
 				for id in idx:
@@ -239,11 +222,9 @@ class PArrayManager(object):
 			topBound = [(x, sizey-1) for x in range(sizex)]
 			elesBound = [(1,1)] + rightBound +topBound
 			i, s1 = 0, len(rightBound)
-			for x0, y0 in elesBound:
-				l = array.bbox.left + array.periodX*x0
-				b = array.bbox.bottom + array.periodY*y0
-				r, t = l+array.periodX, b + array.periodY
-				idx = list(self.polygonTree.intersection((l, b, r, t)))
+			boxes = [self._element_box(array, x0, y0) for x0, y0 in elesBound]
+			for (x0, y0), (l, b, r, t), idx in zip(elesBound, boxes,
+											 self.polygonTree.intersection_batch(boxes)):
 				instString, ov = [], []
 				box = db.Box()
 				for id in idx:
@@ -462,9 +443,7 @@ class PArrayManager(object):
 		projective feature and periods."""
 
 		# rtree for indexing
-		proposalTree = index.Index()
-		for i,proposal in enumerate(self.arrayList):
-			proposalTree.insert(i, proposal.coord_tuple)
+		proposalTree = index_build([p.coord_tuple for p in self.arrayList], phase='proposal')
 
 		obsoletes = {}
 		classifiedX, classifiedY = {}, {}
@@ -487,9 +466,7 @@ class PArrayManager(object):
 				feature.period_proposals(mode='multiple')
 
 				# filter proposals and match periods
-				segmTree = index.Index()
-				for i, segment in enumerate(feature.segmentsX):
-					segmTree.insert(i, (segment[0], 0, segment[1], 1))
+				segmTree = index_build([(s[0], 0, s[1], 1) for s in feature.segmentsX])
 				for ix in sharingProps:
 					if ix in classifiedX:
 						continue
@@ -522,9 +499,7 @@ class PArrayManager(object):
 				feature.period_proposals(mode='multiple')
 
 				# filter proposals and match periods
-				segmTree = index.Index()
-				for i, segment in enumerate(feature.segmentsY):
-					segmTree.insert(i, (segment[0], 0, segment[1], 1))
+				segmTree = index_build([(s[0], 0, s[1], 1) for s in feature.segmentsY])
 				for ix in sharingProps:
 					if ix in classifiedY:
 						continue
@@ -13,15 +13,16 @@
 			  cropping and projecting.
 """
 
-import math, time
+import math
 
 import klayout.db as db
 from bintrees import FastRBTree
 from rtree import index
 
 from layoutHier.utils.pattern import *
+from layoutHier.utils.ingest import PolygonStore
 from layoutHier.utils.helpers import lcm
-from layoutHier.utils.structures import Node, SortedLinkedList
+from layoutHier.utils.structures import TID, Node, SortedLinkedList
 
 __all__ = ["SArray", "SArrayManager"]
 
@@ -253,56 +254,32 @@ class SArrayManager(object):
 		self.noise_cells = index.Index() 	# used to qualify arrays
 
 	@classmethod
-	def rbtrees_build(cls, layout, layer=0, merge=True):
-		"""Construct ArrayManager with polygon r-b trees object from a layout object."""
-		assert isinstance(layout, db.Layout)
-
-		polyTrees = {}
-		polygonLib = PolygonLib([], {}, 0, type='polygon')
-		# encode polygons of the layout
-		end = time.time()
-		try:
-			topCell = layout.top_cell()
-			topCell.flatten(-1, False)
-			boxWhole = topCell.bbox()
-			print("Flatten time is {}".format(time.time()-end))
-			end = time.time()
-		except:
-			print('Layout has nultiple top cell.')
-		if merge:
-			topRegion = db.Region(topCell.begin_shapes_rec(layer))
-			topRegion.merge(layer)
-			topRegion.merged_semantics=0
-			iterator = topRegion.each_merged()
-			print("Merge time is {}".format(time.time()-end))
-			end = time.time()
-		else:
-			iterator = topCell.each_shape(layer)
-		for i, shape in enumerate(iterator):
-			box = shape.bbox()
-			if merge:
-				polygon = shape
-			else:
-				polygon = shape.polygon
-			vertexes = [(point.x, point.y) for point in polygon.each_point_hull()]
-			polygonLib.encode(box, vertexes)
-
-		print("Encode time is {}".format(time.time()-end))
-		print("Polygon count is {}, Layout area is {}".format(i+1, boxWhole.area()))
+	def rbtrees_build(cls, layout, layer=0, merge=True, store=None):
+		"""Construct ArrayManager with polygon r-b trees object from a layout object.
+		@param store: PolygonStore ingested before, layout is parsed if None."""
+		if store is None:
+			store = PolygonStore.from_layout(layout, layer, merge)
+		print("Polygon count is {}, Layout area is {}".format(len(store), store.world.area()))
 
 		# produce red black trees from polygon patterns
 		# rbtree's node--(linked list, corresponding dict)
-		for pattern in polygonLib.patternList:
+		polyTrees = {}
+		boxes = store.bbox.tolist()
+		for pattern, indexes in zip(store.polygonLib.patternList, store.pattern_indexes()):
+			if len(indexes) == 0:
+				continue
 			rbtree = FastRBTree()
-			inst0 = pattern.instList[0]
-			sign = (inst0.bbox.width(), inst0.bbox.height(),
-					0, 0, inst0.pid, inst0.tid, inst0.symmetryType)
+			indexes = indexes.tolist()
+			left, bottom, right, top = boxes[indexes[0]]
+			sign = (right-left, top-bottom, 0, 0, pattern.pid,
+					TID(int(store.tid[indexes[0]])), pattern.symmetryType)
 			polyTrees[sign] = rbtree
-			for inst in pattern.instList:
-				if inst.bbox.left in rbtree:
-					rbtree[inst.bbox.left][inst.bbox.bottom] = 0 # (inst.bbox.right, inst.tid)
+			for i in indexes:
+				left, bottom = boxes[i][0], boxes[i][1]
+				if left in rbtree:
+					rbtree[left][bottom] = 0 # (right, tid)
 				else:
-					rbtree[inst.bbox.left] = {inst.bbox.bottom: 0}
+					rbtree[left] = {bottom: 0}
 
 			# the following is wrong due to the key changing bug of the FastRBTree
 			keys = list(rbtree.keys())
@@ -316,6 +293,13 @@ class SArrayManager(object):
 
 		return cls([], polyTrees)
 
+	@classmethod
+	def from_file(cls, path, layer, window=None, **kwargs):
+		"""Load @param layer of the layout file only, clip at @param window and
+		construct ArrayManager. See PolygonStore.from_layout for @param kwargs."""
+		store = PolygonStore.from_file(path, layer, window, **kwargs)
+		return cls.rbtrees_build(None, store=store)
+
 	@staticmethod
 	def __leapx_find(tree, xa, ya, Threshold=10):
 		prex, count = xa, 1
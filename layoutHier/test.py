@@ -1,10 +1,22 @@
 import os
+import pathlib
 import time
+import tempfile
 import unittest
+from unittest import mock
+import numpy as np
 import klayout.db as db
 
-from layoutHier import  SArrayManager, PArrayManager, HierarchyManager
-from layoutHier.utils.helpers import shapes_save
+from layoutHier import  SArrayManager, PArrayManager, HierarchyManager, PolygonStore
+from layoutHier.utils.helpers import shapes_save, nearest_elements, direction_regions, \
+	rect_dims, rect_orientations, code_transform_basic, code_fingerprint, code_transform, \
+	insts_enlarge, insts_enlarge_rolls, string_rolls, rolls_add, rolls_key, code_unpack, \
+	box_tuple
+from layoutHier.utils.structures import OID, TID, T1, T2, T3, oidToTid
+from layoutHier.utils.spatial import index_build, indexStats, _box_distance, window_build, window_config
+from layoutHier.utils.cache import ExpandCache
+from layoutHier.utils.pattern import PolygonLib, PolygonInstArray, CodeDict, Instance, InstanceList, \
+	Pattern, PatternLib
 
 
 class ArrayManagerTest(unittest.TestCase):
@@ -55,6 +67,21 @@ class HierManagerTest(unittest.TestCase):
 		self.cell = layout.top_cell()
 		self.layout = layout
 		self.name = filename.split('.')[0]
+		self.readFile = readFile
+		self.window = db.Box(0, 0, 6700, 8600)
+
+	def propagate(self, **kwargs):
+		"""Load layer 1000/0 inside the window, propagate with @param kwargs, return the manager and its result.
+		The result is the largest patterns and the (name, child instances, shapes) of the cells restored."""
+		hierManager = HierarchyManager.from_file(self.readFile, '1000/0', self.window)
+		hierManager.unit_patterns_propogate(**kwargs)
+		return hierManager, self.restored(hierManager)
+
+	@staticmethod
+	def restored(hierManager):
+		regions = [[box_tuple(b) for b in boxes] for boxes in hierManager.visualize()]
+		cell = hierManager.overlap_resolve(restore=True)
+		return regions, [(c.name, c.child_instances(), c.shapes(0).size()) for c in cell.layout().each_cell()]
 
 	def test_PArrayManager(self):
 
@@ -70,5 +97,481 @@ class HierManagerTest(unittest.TestCase):
 		# self.layout.write(os.path.join(self.writeDir, self.name+'_child_1.gds'))
 		cell.write(os.path.join(self.writeDir, self.name+'_restore.gds'))
 
+	def test_closures_prefetch(self):
+		units = []
+		serial, result = self.propagate(), self.propagate(processes=2)
+		for hierManager, _ in [serial, result]:
+			units.append([(p.pid, p.canonical(), [(box_tuple(inst.bbox), inst.tid) for inst in p])
+						  for p in hierManager._HierarchyManager__unitLib])
+		self.assertTrue(len(serial[1][0]) > 1)
+		self.assertTrue(len(serial[1][1]) > 1)
+		self.assertEqual(result[1], serial[1])
+		self.assertEqual(units[0], units[1])
+
+	def test_propagate_limits(self):
+		_, (regions, cells) = self.propagate()
+		hierManager, result = self.propagate(limits={'patterns': 2})
+		self.assertTrue(hierManager.truncated)
+		self.assertEqual({limit for _, limit in hierManager.truncated}, {'patterns'})
+		self.assertTrue(1 < len(result[0]) < len(regions))
+		self.assertTrue(1 < len(result[1]) < len(cells))
+		hierManager, result = self.propagate(deadline=0)
+		self.assertEqual(hierManager.truncated, [(None, 'deadline')])
+		self.assertEqual(result[0], [])
+		self.assertEqual([count for _, count, _ in result[1]], [0] * len(result[1]))
+		with self.assertRaises(ValueError):
+			hierManager.unit_patterns_propogate(limits={'stack': 10})
+
+	def test_checkpoint_resume(self):
+		_, serial = self.propagate()
+		save, saved = HierarchyManager.checkpoint_save, []
+		def crash(manager, path):
+			save(manager, path)
+			saved.append(path)
+			if len(saved) == 5:
+				raise KeyboardInterrupt
+		with tempfile.TemporaryDirectory() as folder:
+			path = pathlib.Path(folder) / 'hier.ckpt'
+			with mock.patch.object(HierarchyManager, 'checkpoint_save', crash):
+				with self.assertRaises(KeyboardInterrupt):
+					self.propagate(checkpoint=path, interval=2)
+			layout, _ = PolygonStore.layout_load(self.readFile, '1000/0')
+			hierManager = HierarchyManager.checkpoint_load(path, layout)
+			self.assertEqual(len(hierManager._HierarchyManager__done), 8)
+			hierManager.unit_patterns_resume(checkpoint=path)
+			self.assertEqual(self.restored(hierManager), serial)
+			hierManager = HierarchyManager.checkpoint_load(path, layout)
+			self.assertEqual(self.restored(hierManager), serial)
+			with self.assertRaises(ValueError):
+				HierarchyManager.checkpoint_load(path, layout).unit_patterns_resume(checkpoint=path, interval=0)
+		with self.assertRaises(ValueError):
+			self.propagate(checkpoint=path, interval=0)
+
+	def test_prune(self):
+		serial, result = self.propagate(), self.propagate(prune=True)
+		done = [len(hierManager._HierarchyManager__done) for hierManager, _ in [serial, result]]
+		self.assertTrue(done[1] < done[0])
+		self.assertEqual(result[1][1], serial[1][1])
+
+	def test_seeds_uncovered(self):
+		polygons = PolygonInstArray(np.zeros((6, 4), dtype=np.int64), np.zeros(6), np.ones(6), np.zeros(6))
+		seeds = []
+		for count, rows in [(2, [0, 1]), (3, [2, 3]), (3, [4, 5])]:
+			boxes = [(10*i, 0, 10*i+5, 5) for i in range(count)]
+			seeds.append(Pattern(None, None, [], [Instance(db.Box(*b)) for b in boxes],
+								 [polygons[i] for i in rows], []))
+		coverage = np.zeros(6, dtype=bool)
+		order = []
+		for i in HierarchyManager.seeds_uncovered(seeds, coverage):
+			order.append(i)
+			coverage[[2, 4, 5]] = True		# the first one covers the third, the second partly
+		self.assertEqual(order, [0, 1])
+
+
+class PolygonStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		readFile = os.path.join('.', 'layout', 'gds', 'array', 'testcase1.gds')
+		layout = db.Layout()
+		layout.read(readFile)
+		self.layout = layout
+
+	def test_shared_store(self):
+		store = PolygonStore.from_layout(self.layout, self.layout.layer_indexes()[0])
+		self.assertEqual(store.hull.max()+1, store.offsets.shape[0]-1)
+		self.assertEqual(sum(len(i) for i in store.pattern_indexes()), len(store))
+
+		sManager = SArrayManager.rbtrees_build(None, store=store)
+		pManager = PArrayManager.layout_to_array_proposals(None, store=store)
+		self.assertEqual(len(pManager.polygonList), len(store))
+		self.assertEqual(len(sManager.polygonTrees), store.polygonLib.patternCount)
+		for i in range(len(store)):
+			self.assertEqual(pManager.polygonList[i].bbox, store.box(i))
+
+	def test_store_restore(self):
+		# hierarchical layout, whose shapes are in a child cell of the top
+		layouts = []
+		for shared in (False, True):
+			layout = db.Layout()
+			layout.read(os.path.join('.', 'layout', 'gds', 'normal', 'testcase1.gds'))
+			top, layer = layout.top_cell(), layout.layer_indexes()[0]
+			child = layout.create_cell('child')
+			for i in layout.layer_indexes():
+				child.shapes(i).insert(top.shapes(i))
+				top.shapes(i).clear()
+			top.insert(db.CellInstArray(child.cell_index(), db.Trans()))
+			hierManager = HierarchyManager(layout, PolygonLib([], {}, 0), Pattern(None, None, [], [], [], []))
+			store = PolygonStore.from_layout(layout, layer) if shared else None
+			hierManager.layout_parse(layer, store=store)
+			hierManager.unit_patterns_propogate()
+			cell = hierManager.overlap_resolve(restore=True)
+			# the layout parsed is left unchanged
+			self.assertEqual([(c.name, c.child_instances(), c.shapes(layer).size()) for c in layout.each_cell()],
+							 [(top.name, 1, 0), ('child', 0, child.shapes(layer).size())])
+			self.assertTrue(child.shapes(layer).size() > 0)
+			restored = cell.layout()
+			self.assertIs(restored, hierManager.restoredLayout)
+			layouts.append([(c.name, c.child_instances(), c.shapes(layer).size()) for c in restored.each_cell()])
+		self.assertTrue(len(layouts[0]) > 3)
+		self.assertEqual(layouts[0], layouts[1])
+
+	def test_store_modes(self):
+		readFile = os.path.join('.', 'layout', 'gds', 'normal', 'testcase2.gds')
+		layout = db.Layout()
+		layout.read(readFile)
+		layer = layout.layer_indexes()[0]
+		instCount = layout.top_cell().child_instances()
+
+		rows = []
+		for mode in [{}, {'deep': True}, {'tile': 20000, 'border': 50, 'threads': 2}]:
+			store = PolygonStore.from_layout(layout, layer, **mode)
+			codes = store.polygonLib.patternList
+			rows.append(sorted((tuple(b), tuple(codes[p].code[t-1])) for b, p, t in
+						zip(store.bbox.tolist(), store.pid.tolist(), store.tid.tolist())))
+		self.assertEqual(rows[0], rows[1])
+		self.assertEqual(rows[0], rows[2])
+		self.assertEqual(layout.top_cell().child_instances(), instCount)
+		# rows cached in deep mode are told apart by polygons, not by shape hashes
+		with mock.patch.object(db.Shape, 'hash', lambda shape: 0):
+			store = PolygonStore.from_layout(layout, layer, deep=True)
+		codes = store.polygonLib.patternList
+		self.assertEqual(rows[0], sorted((tuple(b), tuple(codes[p].code[t-1])) for b, p, t in
+							zip(store.bbox.tolist(), store.pid.tolist(), store.tid.tolist())))
+
+	def test_instance_views(self):
+		store = PolygonStore.from_layout(self.layout, self.layout.layer_indexes()[0])
+		instList = store.instances()
+		self.assertEqual(len(instList), len(store))
+		for i in range(0, len(store), 17):
+			inst = instList[i]
+			self.assertEqual(inst.bbox, store.box(i))
+			self.assertEqual((inst.pid, inst.tid.value), (store.pid[i], store.tid[i]))
+		polygonLib = store.polygon_lib(instList)
+		pattern = max(polygonLib.patternList, key=len)
+		pattern.instList[1].visited = True
+		self.assertEqual(sum(inst.visited for inst in instList), 1)
+		self.assertTrue(instList[pattern.instList[1].row].visited)
+		self.assertFalse(any(inst.visited for inst in store.instances()))
+		instList.visited_reset()
+		self.assertFalse(any(inst.visited for inst in pattern.instList))
+
+	def test_window_load(self):
+		readFile = os.path.join('.', 'layout', 'gds', 'array', 'testcase1.gds')
+		window = db.Box(0, 0, 150000, 40000)
+		store = PolygonStore.from_file(readFile, '31/0', window)
+		self.assertTrue(0 < len(store) < len(PolygonStore.from_file(readFile, (31, 0))))
+		for i in range(len(store)):
+			self.assertTrue(store.box(i).inside(window))
+		manager = PArrayManager.from_file(readFile, '31/0', window)
+		self.assertEqual(len(manager.polygonList), len(store))
+
+	def test_enlarge_rolls(self):
+		store = PolygonStore.from_layout(self.layout, self.layout.layer_indexes()[0])
+		instList, elements, tree = store.instances(), store.elements(), store.rtree()
+		boxes = [store.box(i) for i in range(0, len(store), 31)]
+		for window in (None, store.search_window('density')):
+			results = insts_enlarge_rolls(boxes, [None]*len(boxes), instList, elements, tree, window=window)
+			for (strings, boxList), (builders, boxList1, rollsList) in zip(
+					insts_enlarge(boxes, instList, tree, window=window), results):
+				self.assertEqual(boxList, boxList1)
+				for string, builder, rolls in zip(strings, builders, rollsList):
+					self.assertEqual(code_unpack(builder()), string)
+					self.assertEqual(rolls, string_rolls(string))
+
+	def test_search_window(self):
+		# dense 10x10 squares at pitch 20 on the left, sparse ones at pitch 1000 on the right
+		dense = [(x, y, x+10, y+10) for x in range(0, 2000, 20) for y in range(0, 2000, 20)]
+		sparse = [(x, y, x+10, y+10) for x in range(10000, 30000, 1000) for y in range(0, 20000, 1000)]
+		boxes = dense + sparse
+		tree = index_build(boxes)
+		self.assertEqual(window_build(boxes, 'fixed').lengths(boxes[:2]), [(200, 200)]*2)
+		window = window_build(boxes, 'density')
+		lengths = window.lengths([dense[5050], sparse[210]])
+		self.assertLess(lengths[0][0], 200)
+		self.assertGreater(lengths[1][0], 1000)
+		# candidates are bounded, loosely where the coarse grid straddles both densities
+		for box in dense[::97] + sparse[::7]:
+			length = window.lengths([box])[0]
+			self.assertTrue(all(window.minLength <= l <= window.maxLength for l in length))
+			interior = 600 <= box[0] <= 1300 and 600 <= box[1] <= 1300 or box[0] >= 12000
+			for region, _ in direction_regions(db.Box(*box), length):
+				self.assertLessEqual(len(list(tree.intersection(region))), (2 if interior else 5)*window.target)
+		self.assertEqual(nearest_elements(tree, [db.Box(*sparse[210])], [lengths[1]])[0][2],
+						 len(dense) + 230)
+		with self.assertRaises(ValueError):
+			window_config('nearest')
+
+	def test_bulk_index(self):
+		store = PolygonStore.from_layout(self.layout, self.layout.layer_indexes()[0])
+		tree = store.rtree()
+		self.assertIn('polygon', indexStats)
+		for i in range(0, len(store), 97):
+			box = tuple(store.bbox[i].tolist())
+			brute = [j for j, b in enumerate(store.bbox.tolist()) if b[0] <= box[2] and
+					 box[0] <= b[2] and b[1] <= box[3] and box[1] <= b[3]]
+			self.assertEqual(sorted(tree.intersection(box)), brute)
+		# memory is sampled for reported phases only
+		with mock.patch('layoutHier.utils.spatial.memory_usage', return_value=0) as usage:
+			tree = index_build([(0, 0, 1, 1)], [7])
+			self.assertFalse(usage.called)
+			index_build([(0, 0, 1, 1)], phase='test')
+			self.assertTrue(usage.called)
+		tree.insert(3, (0, 0, 2, 2))
+		self.assertEqual(sorted(tree.intersection((0, 0, 1, 1))), [3, 7])
+
+	def test_index_backends(self):
+		store = PolygonStore.from_layout(self.layout, self.layout.layer_indexes()[0])
+		queries = [(l-300, b-300, l+500, b+500) for l, b in store.bbox[::53, :2].tolist()]
+		trees = [index_build(store.bbox, backend=backend) for backend in ('rtree', 'packed')]
+		for tree in trees:
+			for i in range(40):
+				tree.insert(len(store)+i, tuple(store.bbox[i].tolist()))
+			for i in list(range(0, len(store), 9)) + [len(store)+3]:
+				tree.delete(i, tuple(store.bbox[i % len(store)].tolist()))
+		self.assertEqual(len(trees[1]), len(store) + 39 - len(range(0, len(store), 9)))
+		results = [[sorted(x) for x in tree.intersection_batch(queries)] for tree in trees]
+		self.assertEqual(results[0], results[1])
+		results = [[sorted(x) for x in tree.nearest_batch(queries, 2)] for tree in trees]
+		self.assertEqual(results[0], results[1])
+		# nearest in direction, ties might resolve to different items
+		boxes = [store.box(i) for i in range(0, len(store), 7)]
+		bbox = store.bbox.tolist() + store.bbox[:40].tolist()
+		for box, n0, n1 in zip(boxes, *[nearest_elements(tree, boxes) for tree in trees]):
+			for (region, bar), i0, i1 in zip(direction_regions(box, 200), n0, n1):
+				self.assertEqual(i0 is None, i1 is None)
+				if i0 is not None:
+					self.assertEqual(_box_distance(bbox[i0], bar), _box_distance(bbox[i1], bar))
+		# stable closures of seeds are unique
+		seeds = [tuple(b) for b in store.bbox[::11].tolist()]
+		closures = [tree.closure_batch(seeds) for tree in trees]
+		self.assertEqual(closures[0], closures[1])
+		for closure in closures[0]:
+			for i in trees[0].intersection(closure):
+				self.assertTrue(store.box(i % len(store)).inside(db.Box(*closure)))
+
+	def test_batch_encode(self):
+		readFile = os.path.join('.', 'layout', 'gds', 'normal', 'testcase4.gds')
+		layout = db.Layout()
+		layout.read(readFile)
+		region = db.Region(layout.top_cell().begin_shapes_rec(layout.layer_indexes()[0]))
+		hulls = [[(p.x, p.y) for p in polygon.each_point_hull()] for polygon in region.merged().each()]
+		hulls += [[(0, 0), (10, 0), (10, 10), (0, 10)], [(0, 0), (20, 0), (20, 10), (0, 10)]]
+		sequential, batch = PolygonLib([], {}, 0), PolygonLib([], {}, 0)
+		codes = [sequential.encode_code(hull) for hull in hulls]
+		offsets = np.cumsum([0] + [len(hull) for hull in hulls])
+		points = np.array([p for hull in hulls for p in hull])
+		pid, tid, symmetry = batch.encode_batch(offsets, points)
+		self.assertEqual([(p, t.value, s) for p, t, s in codes],
+						 list(zip(pid.tolist(), tid.tolist(), symmetry.tolist())))
+		self.assertEqual(sequential.codeDict, batch.codeDict)
+		self.assertEqual([(p.pid, p.symmetryType, p.code) for p in sequential.patternList],
+						 [(p.pid, p.symmetryType, p.code) for p in batch.patternList])
+
+	def test_rect_encode(self):
+		lib = PolygonLib([], {}, 0)
+		for w, h in [(10, 10), (20, 10), (10, 20)]:
+			for cycle in ([(0, 0), (w, 0), (w, h), (0, h)], [(0, 0), (0, h), (w, h), (w, 0)]):
+				dims = rect_dims(cycle)
+				codes, tids, symmetryType = rect_orientations(*dims)
+				self.assertEqual(codes, [code_transform_basic(codes[0], o, 'polygon') for o in OID])
+				self.assertEqual(codes[0], [(x, y) for x, y in cycle[1:]])
+				self.assertEqual(symmetryType, 0 if w == h else 7)
+				pid, tid, _ = lib.encode_code(cycle)
+				for i in range(1, 4):	# any start vertex
+					self.assertEqual(lib.encode_code(cycle[i:]+cycle[:i]), (pid, tid, symmetryType))
+		self.assertEqual(len(lib.rectTable), 6)
+		self.assertEqual(lib.patternCount, 4)
+		self.assertIsNone(rect_dims([(0, 0), (10, 0), (10, 10), (0, 10), (0, 5)]))
+		self.assertIsNone(rect_dims([(0, 0), (10, 0), (10, 10), (0, 11)]))
+
+	def test_rect_orientations(self):
+		polygonLib = PolygonLib([], {}, 0)
+		for w, h in [(3, 5), (5, 3), (4, 4)]:
+			for counterClockwise in (True, False):
+				codes, tids, symmetry = rect_orientations(w, h, counterClockwise)
+				self.assertEqual(codes, [code_transform_basic(codes[0], OID(i+1), 'polygon')
+										 for i in range(8)])
+				hull = [(10, 20), (10+w, 20), (10+w, 20+h), (10, 20+h)]
+				if not counterClockwise:
+					hull.reverse()
+				self.assertEqual(rect_dims(hull), (w, h, counterClockwise))
+				pid, tid, symmetryType = polygonLib.encode_code(hull)
+				self.assertEqual(symmetryType, symmetry)
+				self.assertEqual(polygonLib.patternList[pid].code[tid.value-1], codes[0])
+		self.assertEqual(polygonLib.patternCount, 4)
+		self.assertIsNone(rect_dims([(0, 0), (2, 0), (3, 1), (1, 1)]))
+
+
+class ExpandCacheTest(unittest.TestCase):
+
+	def test_eviction(self):
+		cache = ExpandCache(budget=300)
+		cache.put('a', 1, 100)
+		cache.put('b', 2, 100, visited=True)
+		cache.put('c', 3, 100)
+		self.assertEqual(cache.get('a'), 1)		# b is the least recently used
+		cache.put('d', 4, 100)
+		self.assertIsNone(cache.get('b'))
+		self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 1, 1))
+		cache.put('e', 5, 100, visited=True)	# c is evicted
+		cache.visited_update()
+		self.assertEqual([cache.get(k) for k in 'acde'], [1, None, 4, None])
+		self.assertEqual((cache.size, cache.epoch), (200, 1))
+		cache.put('f', 6, 1000)		# larger than budget
+		self.assertIsNone(cache.get('f'))
+		self.assertEqual(len(cache), 2)
+
+	def test_merge(self):
+		cache, other = ExpandCache(budget=300), ExpandCache(budget=300)
+		cache.put('a', 1, 100)
+		other.put('a', 2, 100)
+		other.put('b', 3, 100, visited=True)
+		other.put('c', 4, 100)
+		self.assertEqual(other.items(), [('a', 2, 100), ('c', 4, 100)])
+		cache.merge(other.items())
+		self.assertEqual([cache.get(k) for k in 'abc'], [1, None, 4])
+
+	def test_fingerprint(self):
+		self.assertEqual(code_fingerprint([(0.0, -0.0, 3, T1, 0)]), code_fingerprint([(0, 0, 3, T1, 0)]))
+		self.assertNotEqual(code_fingerprint([(0, 0, 3, T1, 0)]), code_fingerprint([(0, 0, 3, T2, 0)]))
+		self.assertNotEqual(code_fingerprint([(1, 2)]), code_fingerprint([(2, 1)]))
+
+	def test_collision(self):
+		codeDict = CodeDict({((1, 2), (3, 4)): [0, T1]})
+		self.assertEqual(codeDict.get([(1, 2), (3, 4)]), [0, T1])
+		self.assertNotIn([(3, 4), (1, 2)], codeDict)
+		with mock.patch('layoutHier.utils.pattern.code_fingerprint', lambda code: 0):
+			codeDict = CodeDict()
+			codeDict[[(1, 2)]] = [0, T1]
+			codeDict[[(2, 1)]] = [1, T2]
+			self.assertEqual(len(codeDict), 2)
+			self.assertEqual(codeDict[[(2, 1)]], [1, T2])
+			self.assertEqual(codeDict.get([(1, 2)]), [0, T1])
+			self.assertIsNone(codeDict.get([(1, 1)]))
+
+
+class PatternLibTest(unittest.TestCase):
+
+	def test_canonical_encode(self):
+		box = db.Box(-50, -50, 50, 50)
+		strings = [[(0, 0, 0, T1, 0), (10, 0, 1, T1, 3), (10, 20, 0, T3, 0)],
+				   [(-10, 0, 0, T1, 0), (10, 0, 0, T2, 0)],
+				   [(x, y, 0, T1, 8) for x in (-5, 5) for y in (-5, 5)]]
+		for string in strings:
+			for first in OID:
+				# TIDs and symmetry type as registering all orientation codes
+				ref = code_transform(sorted(string, key=lambda x: (x[0], x[1], x[2], x[3].value)), first)
+				codes = [code_transform(ref, o) for o in OID]
+				distinct = [c for i, c in enumerate(codes) if c not in codes[:i]]
+				oidTid = {o: TID(distinct.index(c)+1) for o, c in zip(OID, codes)}
+				symmetryType = oidToTid.index(oidTid) if oidTid in oidToTid else 0
+				lib = PatternLib([], {}, 0)
+				for code in [ref] + codes:
+					inst = lib.encode(list(code), box)
+					self.assertEqual(inst.tid, TID(distinct.index(code)+1))
+					self.assertEqual(lib.patternList[0].restore(inst), code)
+				self.assertEqual((lib.patternCount, len(lib.codeDict)), (1, 1))
+				self.assertEqual(lib.patternList[0].symmetryType, symmetryType)
+				self.assertTrue(lib.any_same(lib.patternList[0]))
+
+	def test_hash_collision(self):
+		box = db.Box(-50, -50, 50, 50)
+		strings = [[(0, 0, 0, T1, 0), (10, 0, 1, T1, 3), (10, 20, 0, T3, 0)],
+				   [(-10, 0, 0, T1, 0), (10, 0, 0, T2, 0)],
+				   [(x, y, 0, T1, 8) for x in (-5, 5) for y in (-5, 5)]]
+		def encode(lib):
+			return [lib.encode(code_transform(string, o), box).tid for string in strings for o in OID]
+		exact, collided = PatternLib([], {}, 0), PatternLib([], {}, 0)
+		tids = encode(exact)
+		# all codes and all of their orientations share one hash
+		with mock.patch('layoutHier.utils.pattern.rolls_key', lambda rolls, x2, y2: (0, list(range(8)))):
+			self.assertEqual(encode(collided), tids)
+			lib = PatternLib([], {}, 0)
+			lib.encode(strings[0], box)
+		self.assertEqual((exact.collisions, collided.collisions), (0, 2))
+		self.assertEqual(collided.patternCount, exact.patternCount)
+		self.assertEqual([p.symmetryType for p in collided], [p.symmetryType for p in exact])
+		self.assertTrue(lib.any_same(collided.patternList[0]))
+		self.assertFalse(lib.any_same(collided.patternList[1]))
+
+	def test_rolls(self):
+		string = [(0.5, 0, 0, T1, 0), (10, 20.5, 1, T2, 3)]
+		added = [(30, 0, 2, T1, 8)]
+		self.assertEqual(rolls_add(string_rolls(string), string_rolls(added)), string_rolls(string + added))
+		moved = [(x+7, y-3.5, pid, tid, s) for x, y, pid, tid, s in string]
+		self.assertEqual(rolls_key(string_rolls(string), 0, 0), rolls_key(string_rolls(moved), 14, -7))
+		self.assertNotEqual(rolls_key(string_rolls(string), 0, 0), rolls_key(string_rolls(moved), 0, 0))
+
+	def test_instance_list(self):
+		boxes = [db.Box(x, y, x+10, y+5) for x in (30, -20, 0) for y in (7, -3)]
+		insts = InstanceList(Instance(box, 0, T1) for box in boxes + boxes[:2])
+		self.assertEqual(len(insts), len(boxes))
+		self.assertEqual([box_tuple(inst.bbox) for inst in insts],
+						 sorted(box_tuple(box) for box in boxes))
+		self.assertTrue(Instance(db.Box(0, -3, 1, 1)) in insts)
+		self.assertFalse(Instance(db.Box(0, 0, 10, 5)) in insts)
+		self.assertFalse(insts.insert(Instance(db.Box(-20, 7, -10, 12))))
+		self.assertTrue(insts.insert(Instance(db.Box(0, 0, 10, 5))))
+		self.assertEqual(insts.intersection((1, 3, 2, 4)), [3])
+		# the index is kept in sync instead of being built again
+		tree = insts.rtree
+		insts.remove(Instance(db.Box(-20, -3, 0, 0)))
+		self.assertEqual(insts.intersection((1, 3, 2, 4)), [2])
+		self.assertEqual(insts.index(Instance(db.Box(30, 7, 31, 8))), len(insts)-1)
+		self.assertTrue(insts.insert(Instance(boxes[3])))
+		insts.remove(Instance(db.Box(0, 0, 10, 5)))
+		self.assertFalse(Instance(db.Box(0, 0, 1, 1)) in insts)
+		with self.assertRaises(ValueError):
+			insts.remove(Instance(db.Box(0, 0, 10, 5)))
+		self.assertIs(insts.rtree, tree)
+		self.assertEqual(insts.intersection((-15, -2, 1, 1)), [0, 2])
+		self.assertEqual([box_tuple(inst.bbox) for inst in insts],
+						 sorted(box_tuple(box) for box in boxes))
+		self.assertEqual(len(insts), len(boxes))
+		# positions agree with a brute force scan through interleaved updates
+		for backend in ('rtree', 'packed'):
+			insts = InstanceList()
+			with mock.patch.dict('layoutHier.utils.spatial.indexConfig', backend=backend):
+				insts.rtree
+				for k in range(300):
+					insts.insert(Instance(db.Box(k*7 % 101, k*13 % 97, k*7 % 101 + 5, k*13 % 97 + 5)))
+					if k % 3 == 2:
+						insts.remove(insts[k*5 % len(insts)])
+					query = (k % 90, k*3 % 90, k % 90 + 10, k*3 % 90 + 10)
+					brute = [i for i, inst in enumerate(insts) if inst.bbox.left <= query[2] and
+							 query[0] <= inst.bbox.right and inst.bbox.bottom <= query[3] and
+							 query[1] <= inst.bbox.top]
+					self.assertEqual(insts.intersection(query), brute)
+
+	def test_any_include(self):
+		def pattern(boxes):
+			return Pattern(None, None, [], [Instance(db.Box(*box)) for box in boxes], [], [])
+		lib = PatternLib([], {}, 0)
+		lib.patternList.append(pattern([(0, 0, 100, 100), (200, 0, 300, 100)]))
+		lib.patternList.append(pattern([(0, 0, 50, 50)]))
+		self.assertTrue(lib.any_include(pattern([(210, 10, 220, 20), (500, 0, 510, 10)])))
+		self.assertFalse(lib.any_include(pattern([(90, 90, 120, 120), (500, 0, 510, 10)])))
+		self.assertFalse(lib.any_include(pattern([(10, 10, 20, 20), (30, 0, 40, 10), (0, 30, 10, 40)])))
+		child = pattern([(10, 10, 20, 20)])
+		child.childPatterns.append(lib.patternList[0])
+		self.assertFalse(lib.any_include(pattern([(60, 60, 70, 70)])))
+		lib.patternList.append(pattern([(0, 0, 80, 80)]))
+		self.assertTrue(lib.any_include(child))
+		self.assertEqual(lib.patternList[1].childPatterns, [lib.patternList[0]])
+		self.assertEqual(lib.patternList[2].childPatterns, [])
+		self.assertTrue(lib.any_include(pattern([(60, 60, 70, 70)])))
+
+	def test_lazy_resources(self):
+		lib = PatternLib([], {}, 0)
+		lib.encode([(0, 0, 0, T1, 0), (10, 0, 1, T1, 3)], db.Box(-5, -5, 15, 5))
+		pattern = lib.patternList[0]
+		self.assertIsNone(pattern.instList._InstanceList__rtree)
+		self.assertIsNone(pattern._Pattern__cell)
+		pattern.rtree_update()
+		self.assertEqual(list(pattern.rtree.intersection((0, 0, 1, 1))), [0])
+		self.assertIsInstance(pattern.cell, db.Cell)
+		self.assertFalse(hasattr(pattern, '__dict__'))
+
+
 if __name__ == '__main__':
 	unittest.main()
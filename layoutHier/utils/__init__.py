@@ -1,3 +1,6 @@
 import layoutHier.utils.helpers
 import layoutHier.utils.pattern
 import layoutHier.utils.structures
+import layoutHier.utils.spatial
+import layoutHier.utils.cache
+import layoutHier.utils.ingest
@@ -0,0 +1,94 @@
+"""
+@version: 	0.1
+@brief:     Memoizing cache of box expansions.
+Closures of seed boxes and 5-tuple strings of stable boxes only depend on the
+polygon index, while instance enlargements depend on visited flags as well and
+are stored with the flags they read, see enlarge_closures. Entries may also be
+keyed by the visited epoch, which is bumped whenever the flags change.
+"""
+
+from collections import OrderedDict
+
+__all__ = ["ExpandCache"]
+
+
+class ExpandCache(object):
+	"""LRU cache bounded by an estimated memory budget in bytes."""
+
+	def __init__(self, budget=256*1024*1024):
+		self.budget = budget
+		self.size = 0		# estimated bytes of all entries
+		self.epoch = 0		# visited epoch
+		self.hits, self.misses, self.evictions = 0, 0, 0
+		self.__entries = OrderedDict()	# key => (value, size)
+		self.__visitedKeys = set()		# keys depending on visited flags
+
+	def __len__(self):
+		return len(self.__entries)
+
+	def __str__(self):
+		return "hits {}, misses {}, evictions {}, entries {}, size {} KB".format(
+			self.hits, self.misses, self.evictions, len(self), self.size//1024)
+
+	@staticmethod
+	def estimate(indexes=0, strings=0):
+		"""Rough bytes of an entry with @param indexes element indexes and
+		@param strings 5-tuples."""
+		return 200 + 36*indexes + 240*strings
+
+	def get(self, key):
+		"""Value of @param key, None if it is not cached."""
+		entry = self.__entries.get(key)
+		if entry is None:
+			self.misses += 1
+			return None
+		self.__entries.move_to_end(key)
+		self.hits += 1
+		return entry[0]
+
+	def put(self, key, value, size, visited=False):
+		"""Cache @param value of estimated @param size bytes, set @param visited
+		if the value depends on visited flags. Least recently used entries are
+		evicted to keep in budget."""
+		if key in self.__entries:
+			self.__remove(key)
+		if size > self.budget:
+			return
+		self.__entries[key] = (value, size)
+		self.size += size
+		if visited:
+			self.__visitedKeys.add(key)
+		while self.size > self.budget:
+			self.__remove(next(iter(self.__entries)))
+			self.evictions += 1
+
+	def __remove(self, key):
+		value, size = self.__entries.pop(key)
+		self.size -= size
+		self.__visitedKeys.discard(key)
+
+	def visited_update(self):
+		"""Called when visited flags change, entries depending on them are dropped."""
+		self.epoch += 1
+		for key in self.__visitedKeys:
+			value, size = self.__entries.pop(key)
+			self.size -= size
+		self.__visitedKeys = set()
+
+	def items(self):
+		"""(key, value, size) of entries independent of visited epoch, from the
+		least recently used, which can be merged into another cache."""
+		return [(key, value, size) for key, (value, size) in self.__entries.items()
+				if key not in self.__visitedKeys]
+
+	def merge(self, items):
+		"""Put @param items of another cache, see @method items. Entries cached
+		already are kept."""
+		for key, value, size in items:
+			if key not in self.__entries:
+				self.put(key, value, size)
+
+	def clear(self):
+		self.__entries.clear()
+		self.__visitedKeys = set()
+		self.size = 0
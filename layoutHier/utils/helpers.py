@@ -6,10 +6,16 @@
 @brief:     Define some help functions.
 """
 
+import gc
+import hashlib
+from contextlib import contextmanager
+from functools import lru_cache, partial
+
+import numpy as np
 import klayout.db as db
-from rtree import index
 
 from layoutHier.utils.structures import *
+from layoutHier.utils.spatial import index_build, FixedWindow
 
 
 def lcm(a, b):
@@ -24,6 +30,18 @@ def lcm(a, b):
 		a, b = b, c
 	return int(m*n/a)
 
+@contextmanager
+def gc_paused():
+	"""Pause the cyclic garbage collector while objects are created in bulk,
+	since each collection triggered by allocations scans the whole heap."""
+	enabled = gc.isenabled()
+	gc.disable()
+	try:
+		yield
+	finally:
+		if enabled:
+			gc.enable()
+
 #********maximal repetition finding********
 def maximal_periods(string):
 	"""Implementation of an algorithm computing the repetitions in a word. Please
@@ -156,105 +174,111 @@ def maximal_periods(string):
 
 #********fundamental functions for Pattern********
 
-def inst_enlarge(bbox, instList, rtree, incremental=False):
+def inst_enlarge(bbox, instList, rtree, incremental=False, window=None):
 	"""Enlarge the given instance in all direction and return the new instance list.
 	@param bbox  the bounding box of the instance.
 	@param instList  the list containing element instances.
 	@param rtree  all basic element index are stored in a rtree.
+	@param window  search window policy of nearest elements, see enlarge_closures.
 	"""
-	workingLen = 200
+	return insts_enlarge([bbox], instList, rtree, incremental, window=window)[0]
 
-	flagLeft, flagBottom, flagRight, flagTop = False, False, False, False
-	stringList, boxList = [], []
-	(instLeft, instBottom, instRight, instTop) = box_tuple(bbox)
+def insts_enlarge(boxes, instList, rtree, incremental=False, cache=None, window=None):
+	"""Enlarge all instances of @param boxes in all direction by batch queries and
+	return (stringList, boxList) of each instance, see inst_enlarge. Strings of
+	@param incremental enlargements hold the added elements and the center of
+	the former instance only."""
 	if incremental:
 		#elements (polygon) forming the instance
-		formerList = list(rtree.intersection((instLeft, instBottom, instRight, instTop)))
-
-	#left direction
-	aimRegion = (instLeft - workingLen, instBottom, instLeft-1, instTop)
-	leftBar = (instLeft-1, instBottom, instLeft-1, instTop)
-	flagLeft, nearestLeft = nearest_element(rtree, instList, aimRegion, leftBar)  #obtain the nearest element
-	if flagLeft:
-		bboxSeed = db.Box(bbox.left, bbox.bottom, bbox.right, bbox.top) + nearestLeft.bbox #merge box to get original box
-		bboxStable1, inst1 = box_expand(bboxSeed, instList, rtree)              #expand the seed to get new stale inst without cutting
-		if incremental:
-			for idx in formerList:
-				inst1.remove(idx)
-			string1 = indexes_to_string(inst1, instList)
-			string1.append(( (instLeft+instRight)/2, (instBottom + instTop)/2, -1, T1, 7))
-		else:
-			string1 = indexes_to_string(inst1, instList)
-		stringList.append(string1)
-		boxList.append(bboxStable1)
-
-	#bottom direction
-	aimRegion = (instLeft, instBottom-workingLen, instRight, instBottom-1)
-	bottomBar = (instLeft, instBottom, instRight, instBottom)
-	flagBottom, nearestBottom = nearest_element(rtree, instList, aimRegion, bottomBar)
-	if flagBottom:
-		not_same = True
-		bboxSeed = db.Box(bbox.left, bbox.bottom, bbox.right, bbox.top) + nearestBottom.bbox
-		bboxStable2, inst2 = box_expand(bboxSeed, instList, rtree)
-		for boxx in boxList:
-			if boxx == bboxStable2:
-				not_same = False
-		if not_same:
-			if incremental:
-				for idx in formerList:
-					inst2.remove(idx)
-				string2 = indexes_to_string(inst2, instList)
-				string2.append(( (instLeft+instRight)/2, (instBottom + instTop)/2, -1, T1, 7))
-			else:
-				string2 = indexes_to_string(inst2, instList)
-			stringList.append(string2)
-			boxList.append(bboxStable2)
-
-	#right direction
-	aimRegion = (instRight+1, instBottom, instRight+workingLen, instTop)
-	rightBar = (instRight, instBottom, instRight, instTop)
-	flagRight, nearestRight = nearest_element(rtree, instList, aimRegion, rightBar)
-	if flagRight:
-		not_same = True
-		bboxSeed = db.Box(bbox.left, bbox.bottom, bbox.right, bbox.top) + nearestRight.bbox
-		bboxStable3, inst3 = box_expand(bboxSeed, instList, rtree)
-		for boxx in boxList:
-			if boxx == bboxStable3:
-				not_same = False
-		if not_same:
+		formerLists = rtree.intersection_batch([box_tuple(bbox) for bbox in boxes])
+	results = []
+	for k, closures in enumerate(enlarge_closures(boxes, instList, rtree, cache, window)):
+		stringList, boxList = [], []
+		former = set(formerLists[k]) if incremental else None
+		for bboxStable, inst in closures:
 			if incremental:
-				for idx in formerList:
-					inst3.remove(idx)
-				string3 = indexes_to_string(inst3, instList)
-				string3.append(( (instLeft+instRight)/2, (instBottom + instTop)/2, -1, T1, 7))
+				string = indexes_to_string([idx for idx in inst if idx not in former], instList)
+				bbox = boxes[k]
+				string.append(( (bbox.left+bbox.right)/2, (bbox.bottom + bbox.top)/2, -1, T1, 7))
 			else:
-				string3 = indexes_to_string(inst3, instList)
-			stringList.append(string3)
-			boxList.append(bboxStable3)
-
-	#top direction
-	aimRegion = (instLeft, instTop+1, instRight, instTop+workingLen)
-	topBar = (instLeft, instTop, instRight, instTop)
-	flagTop, nearestTop = nearest_element(rtree, instList, aimRegion, topBar)
-	if flagTop:
-		not_same = True
-		bboxSeed = db.Box(bbox.left, bbox.bottom, bbox.right, bbox.top) + nearestTop.bbox
-		bboxStable4, inst4 = box_expand(bboxSeed, instList, rtree)
-		for boxx in boxList:
-			if boxx == bboxStable4:
-				not_same = False
-		if not_same:
-			if incremental:
-				for idx in formerList:
-					inst4.remove(idx)
-				string4 = indexes_to_string(inst4, instList)
-				string4.append(( (instLeft+instRight)/2, (instBottom + instTop)/2, -1, T1, 7))
-			else:
-				string4 = indexes_to_string(inst4, instList)
-			stringList.append(string4)
-			boxList.append(bboxStable4)
-
-	return stringList, boxList
+				string = closure_string(bboxStable, inst, instList, cache)
+			stringList.append(string)
+			boxList.append(bboxStable)
+		results.append((stringList, boxList))
+	return results
+
+def insts_enlarge_rolls(boxes, rolls, instList, elements, rtree, cache=None, window=None):
+	"""Enlarge all instances of @param boxes like insts_enlarge, but codes are
+	hashed incrementally: rolls of an enlargement are @param rolls of its
+	instance plus those of the added elements only. Packed codes are returned
+	as functions taking them from @param elements, which are called for new
+	patterns only.
+	@param rolls: rolls of each instance, None if unknown.
+	@param elements: packed 5-tuples of all elements, see PolygonStore.elements.
+	@return: list of (codeList, boxList, rollsList) of each instance."""
+	formerLists = rtree.intersection_batch([box_tuple(bbox) for bbox in boxes])
+	results = []
+	for k, closures in enumerate(enlarge_closures(boxes, instList, rtree, cache, window)):
+		former = formerLists[k]
+		base = rolls[k] if rolls[k] is not None else code_rolls(elements[list(former)])
+		former = set(former)
+		codeList, boxList, rollsList = [], [], []
+		for bboxStable, inst in closures:
+			codeList.append(partial(np.take, elements, inst, axis=0))
+			boxList.append(bboxStable)
+			key = ('added', box_tuple(boxes[k]), box_tuple(bboxStable))
+			added = None if cache is None else cache.get(key)
+			if added is None:
+				added = code_rolls(elements[list(set(inst) - former)])
+				if cache is not None:
+					cache.put(key, added, cache.estimate())
+			rollsList.append(rolls_add(base, added))
+		results.append((codeList, boxList, rollsList))
+	return results
+
+def enlarge_closures(boxes, instList, rtree, cache=None, window=None):
+	"""(stable box, element indexes inside) of the distinct enlargements of
+	each of @param boxes in all direction. Results are memoized in @param cache
+	(ExpandCache) if given, with the flags of nearest elements they depend on,
+	and are reused while the flags are unchanged. Nearest elements are searched
+	within windows chosen by @param window (FixedWindow or DensityWindow),
+	200 long if None."""
+	window = FixedWindow() if window is None else window
+	boxes0 = [box_tuple(bbox) for bbox in boxes]
+	workingLens = window.lengths(boxes0)
+
+	results = [None]*len(boxes)
+	if cache is not None:
+		keys = [('enlarge', box, workingLen) for box, workingLen in zip(boxes0, workingLens)]
+		for k, key in enumerate(keys):
+			value = cache.get(key)
+			if value is not None and all(nearest_flag(idx, instList)[0] == flag for idx, flag in value[0]):
+				results[k] = [(db.Box(*b), list(indexes)) for b, indexes in value[1]]
+	todo = [k for k, result in enumerate(results) if result is None]
+
+	#obtain the nearest elements of left, bottom, right and top direction
+	seeds, owners, flags = [], [], {}
+	for k, nearest in zip(todo, nearest_elements(rtree, [boxes[k] for k in todo], [workingLens[k] for k in todo])):
+		bbox = boxes[k]
+		results[k], flags[k] = [], []
+		for idx in nearest:
+			flag, inst = nearest_flag(idx, instList)
+			if idx is not None:
+				flags[k].append((idx, flag))
+			if flag:	#merge box to get original box
+				seeds.append(db.Box(bbox.left, bbox.bottom, bbox.right, bbox.top) + inst.bbox)
+				owners.append(k)
+
+	#expand the seeds to get new stale inst without cutting
+	for k, (bboxStable, inst) in zip(owners, box_closures(rtree, seeds, cache)):
+		if all(bboxStable != b for b, _ in results[k]):
+			results[k].append((bboxStable, inst))
+
+	if cache is not None:
+		for k in todo:
+			cache.put(keys[k], (tuple(flags[k]), tuple((box_tuple(b), tuple(indexes)) for b, indexes in results[k])),
+					  cache.estimate(indexes=sum(len(indexes) for _, indexes in results[k])))
+	return results
 
 def nearest_element(rtree, instList, aimRegion, aimBar):
 	"""Search one direction(left,right,bottom,top) which is represented by aimRegion
@@ -263,23 +287,37 @@ def nearest_element(rtree, instList, aimRegion, aimBar):
 	@param instList  the list containing element instances.
 	@param aimRegion  the region indicating search region.
 	"""
-
-	candidates = list(rtree.intersection( aimRegion) )
-	candTree = index.Index()
-	for i in candidates:
-		candTree.insert(i, box_tuple(instList[i].bbox) )
-	nearest = list(candTree.nearest(aimBar, 1))
-
-	if nearest:
-		inst = instList[nearest[0]]
-		if inst.visited: 		#instance with visited True has been propagated for all, so prune.
-			flag = False
-		else:
-			flag = True
-	else:
-		inst = None
-		flag = False
-	return flag, inst
+	return nearest_flag(rtree.nearest_within(aimRegion, aimBar), instList)
+
+def nearest_flag(idx, instList):
+	"""Return the nearest element of index @param idx and whether to expand to it."""
+	if idx is None:
+		return False, None
+	inst = instList[idx]
+	if inst.visited: 		#instance with visited True has been propagated for all, so prune.
+		return False, inst
+	return True, inst
+
+def direction_regions(bbox, workingLen):
+	"""Search regions and bars of left, bottom, right and top direction of @param bbox.
+	@param workingLen: window length, or (horizontal, vertical) lengths."""
+	(left, bottom, right, top) = box_tuple(bbox)
+	horizontal, vertical = workingLen if isinstance(workingLen, tuple) else (workingLen, workingLen)
+	return [((left-horizontal, bottom, left-1, top), (left-1, bottom, left-1, top)),
+			((left, bottom-vertical, right, bottom-1), (left, bottom, right, bottom)),
+			((right+1, bottom, right+horizontal, top), (right, bottom, right, top)),
+			((left, top+1, right, top+vertical), (left, top, right, top))]
+
+def nearest_elements(rtree, boxes, workingLen=200):
+	"""Nearest element indexes of left, bottom, right and top direction of each
+	of @param boxes by one batch query of the rtree.
+	@param workingLen: window length for all boxes, or a list of one per box,
+	see direction_regions."""
+	if not isinstance(workingLen, list):
+		workingLen = [workingLen]*len(boxes)
+	regions = [r for bbox, length in zip(boxes, workingLen) for r in direction_regions(bbox, length)]
+	nearest = rtree.nearest_within_batch([r[0] for r in regions], [r[1] for r in regions])
+	return [nearest[i:i+4] for i in range(0, len(nearest), 4)]
 
 def box_merge(bbox, bbox1):
 	"""merge bbox1 into bbox to form a bigger one."""
@@ -290,30 +328,48 @@ def box_merge(bbox, bbox1):
 
 def box_expand(boxSeed, eleList, rtree):
 	"""expand the seed box until it stabliziles."""
-
-	while (True):
-		#obtain boxes intersecting with the four edges of the seed(overlaping and touching)
-		boxEdge = list(rtree.intersection((boxSeed.left, boxSeed.top, boxSeed.right, boxSeed.top)))
-		boxEdge.extend( list(rtree.intersection((boxSeed.left, boxSeed.bottom, boxSeed.right, boxSeed.bottom)) ))
-		boxEdge.extend( list(rtree.intersection((boxSeed.left, boxSeed.bottom, boxSeed.left, boxSeed.top)) ))
-		boxEdge.extend( list(rtree.intersection((boxSeed.right, boxSeed.bottom, boxSeed.right, boxSeed.top)) ))
-		boxEdge = list(set(boxEdge))
-
-		#remove inside boxes
-		edgeCopy = boxEdge.copy()
-		for boxIndex in edgeCopy:
-			box = eleList[boxIndex].bbox
-			if box.inside(boxSeed):
-				boxEdge.remove(boxIndex)
-
-		if boxEdge:
-			for boxIndex in boxEdge:
-				box = eleList[boxIndex].bbox
-				box1 = boxSeed + box
-				box_merge(boxSeed, box)
-		else:
-			instList = list( rtree.intersection(box_tuple(boxSeed)) )
-			return boxSeed, instList         #new stable instance bounding box and corresponding element index
+	box, instList = box_closures(rtree, [boxSeed])[0]
+	box_merge(boxSeed, box)
+	return boxSeed, instList         #new stable instance bounding box and corresponding element index
+
+def box_closures(rtree, seeds, cache=None):
+	"""Expand all @param seeds until they stablizilize by one batch query of the
+	rtree and return (stable box, element indexes inside) of each seed. Results
+	are memoized in @param cache (ExpandCache) if given."""
+	seeds = [box_tuple(b) for b in seeds]
+	closures = [None]*len(seeds)
+	if cache is not None:
+		closures = [cache.get(('closure', seed)) for seed in seeds]
+	todo = [k for k, closure in enumerate(closures) if closure is None]
+	boxes = rtree.closure_batch([seeds[k] for k in todo])
+	for k, box, indexes in zip(todo, boxes, rtree.intersection_batch(boxes)):
+		closures[k] = (box, indexes)
+		if cache is not None:
+			cache.put(('closure', seeds[k]), (box, tuple(indexes)), cache.estimate(indexes=len(indexes)))
+	return [(db.Box(*box), list(indexes)) for box, indexes in closures]
+
+def closure_rolls(bbox, indexes, elements, cache=None):
+	"""Rolls of @param elements at @param indexes inside the stable box @param
+	bbox, see code_rolls. Results are memoized in @param cache if given."""
+	key = ('rolls', box_tuple(bbox))
+	rolls = None if cache is None else cache.get(key)
+	if rolls is None:
+		rolls = code_rolls(elements[indexes])
+		if cache is not None:
+			cache.put(key, rolls, cache.estimate())
+	return rolls
+
+def closure_string(bbox, indexes, instList, cache=None):
+	"""indexes_to_string of elements @param indexes inside stable box @param bbox,
+	memoized in @param cache (ExpandCache) if given."""
+	if cache is None:
+		return indexes_to_string(indexes, instList)
+	key = ('string', box_tuple(bbox))
+	string = cache.get(key)
+	if string is None:
+		string = tuple(indexes_to_string(indexes, instList))
+		cache.put(key, string, cache.estimate(strings=len(string)))
+	return list(string)
 
 def box_tuple(bbox):
 	"""return a tuple."""
@@ -462,6 +518,257 @@ def code_transform(code, oid):
 		return newCode
 
 
+#*********expansion prefetch************
+def groups_pack(pieces, weights, count):
+	"""Pack @param pieces, lists of item indexes, into at most @param count
+	groups balanced by @param weights of items, heaviest piece first.
+	@return: list of item index lists in ascending order."""
+	groups, loads = [[] for _ in range(count)], [0]*count
+	for piece in sorted(pieces, key=lambda p: (-sum(weights[i] for i in p), p[0])):
+		b = loads.index(min(loads))
+		groups[b].extend(piece)
+		loads[b] += sum(weights[i] for i in piece)
+	return [sorted(group) for group in groups if group]
+
+#********vectorized polygon codes********
+
+# (a, b, c, d) of O1-O8 transforming (x, y) into (a*x + b*y, c*x + d*y)
+oidMatrix = ((1, 0, 0, 1), (-1, 0, 0, 1), (0, -1, 1, 0), (0, 1, 1, 0),
+			 (-1, 0, 0, -1), (1, 0, 0, -1), (0, 1, -1, 0), (0, -1, -1, 0))
+# TID values of O1-O8 for each symmetry type
+oidTidTable = np.array([[oidToTid[s][OID(i+1)].value for i in range(8)] for s in range(9)])
+
+def polygon_codes(cycles):
+	"""Vectorized rotation of PolygonLib.encode_code, vertex cycles are rotated
+	to begin with the lowest left vertex.
+	@param cycles: (m, n, 2) int array of counter-clockwise vertexes.
+	@return: (m, n-1, 2) array of vertex offsets from the lowest left one."""
+	m, n = cycles.shape[:2]
+	cycles = np.ascontiguousarray(cycles, dtype=np.int64)
+	x, y = cycles[..., 0], cycles[..., 1]
+	xMin, yMin = x.min(), y.min()
+	height = int(y.max()) - int(yMin) + 1
+	if (int(x.max()) - int(xMin) + 1)*height < 2**62:	# lexicographic order as one integer
+		lowest = (x - xMin)*height + (y - yMin)
+	else:
+		lowest = np.where(x == x.min(axis=1, keepdims=True), y, np.iinfo(np.int64).max)
+	order = np.arange(n) + lowest.argmin(axis=1)[:, None]
+	order[order >= n] -= n
+	# gather points as 16-byte items
+	cycles = np.take_along_axis(cycles.view(np.complex128)[..., 0], order, axis=1)
+	cycles = cycles.view(np.int64).reshape(m, n, 2)
+	return cycles[:, 1:] - cycles[:, :1]
+
+def code_hashes(codes):
+	"""64-bit hashes of rows of int array @param codes, equal rows have equal
+	hashes while different rows collide with probability about 2**-64."""
+	weights = np.random.RandomState(codes.shape[1]).randint(1, 2**62, codes.shape[1], dtype=np.int64)
+	return (codes.astype(np.uint64)*(weights.astype(np.uint64) | np.uint64(1))).sum(axis=1, dtype=np.uint64)
+
+def code_fingerprint(code):
+	"""Stable 64-bit structural fingerprint of a polygon code [(x, y), ...] or a
+	pattern code [(x, y, pid, tid, symmetryType), ...]. Equal codes have equal
+	fingerprints in every run and process, unlike hash() of TIDs."""
+	width = len(code[0]) if len(code) else 0
+	if width == 5:
+		code = [(e[0], e[1], e[2], e[3].value, e[4]) for e in code]
+	values = np.array(code, dtype=np.float64).reshape(-1) + 0.0		# -0.0 as 0.0
+	digest = hashlib.blake2b(values.tobytes(), digest_size=8, salt=bytes([width]))
+	return int.from_bytes(digest.digest(), 'little')
+
+def dihedral_codes(codes):
+	"""Vectorized code_transform_basic of polygon type for all of O1-O8.
+	@param codes: (m, n-1, 2) array of O1 codes.
+	@return: (8, m, n-1, 2) array."""
+	cycles = np.concatenate((np.zeros_like(codes[:, :1]), codes), axis=1)
+	x, y = cycles[..., 0], cycles[..., 1]
+	result = []
+	for i, (a, b, c, d) in enumerate(oidMatrix):
+		transformed = np.stack((a*x + b*y, c*x + d*y), axis=-1)
+		if i % 2:	# mirrored, the cycle is reversed
+			transformed = np.roll(transformed[:, ::-1], 1, axis=1)
+		result.append(polygon_codes(transformed))
+	return np.stack(result)
+
+def dihedral_tids(codes8):
+	"""TID of each orientation and symmetry type like PolygonLib.encode_code.
+	@param codes8: (8, m, n-1, 2) array from dihedral_codes.
+	@return: tuple((m, 8) TID values of O1-O8, (m,) symmetry types)."""
+	same = np.all(codes8[:, None] == codes8[None, :], axis=(3, 4)).transpose(2, 0, 1)
+	first = same.argmax(axis=2)		# first orientation with the same code
+	distinct = first == np.arange(8)
+	tids = np.take_along_axis(np.cumsum(distinct, axis=1), first, axis=1)
+	match = np.all(tids[:, None, :] == oidTidTable[None, :8], axis=2)	# as searched by encode_code
+	return tids, np.where(match.any(axis=1), match.argmax(axis=1), 0)
+
+#*********canonical pattern codes*********
+def _oid_product(i, j):
+	"""Index of the OID applying O(j+1) and than O(i+1)."""
+	a, b, c, d = oidMatrix[i]
+	e, f, g, h = oidMatrix[j]
+	return oidMatrix.index((a*e + b*g, a*f + b*h, c*e + d*g, c*f + d*h))
+
+# oidCompose[i][j]: index of O(i+1) after O(j+1), oidInverse[i]: index of inverse of O(i+1)
+oidCompose = [[_oid_product(i, j) for j in range(8)] for i in range(8)]
+oidInverse = [oidCompose[i].index(0) for i in range(8)]
+# tidTable[s, t, i]: value of tid_update(TID(t), OID(i+1), s), 0 if TID(t) is not of type s
+tidTable = np.array([[[tid_update(TID(t), OID(i+1), s).value if t and TID(t) in tidToOid[s] else 0
+					   for i in range(8)] for t in range(9)] for s in range(9)], dtype=np.int64)
+
+def code_pack(string):
+	"""Packed code of the 5-tuple like string, which is a (m, 5) int64 array of
+	rows (2*x, 2*y, pid, TID value, symmetryType)."""
+	return np.array([(int(2*e[0]), int(2*e[1]), e[2], e[3].value, e[4]) for e in string],
+					dtype=np.int64).reshape(-1, 5)
+
+def code_unpack(code):
+	"""5-tuple like string of packed @param code."""
+	return [(x/2, y/2, pid, TID(tid), s) for x, y, pid, tid, s in code.tolist()]
+
+def code_sort(code):
+	"""Sort rows of packed @param code lexicographically."""
+	return code[np.lexsort(code.T[::-1])]
+
+def code_orient(code, i):
+	"""code_transform of packed code @param code by OID(i+1), TIDs are updated
+	through tidTable."""
+	if i == 0:
+		return code
+	a, b, c, d = oidMatrix[i]
+	x, y, symmetry = code[:, 0], code[:, 1], code[:, 4]
+	return code_sort(np.column_stack((a*x + b*y, c*x + d*y, code[:, 2],
+									  tidTable[symmetry, code[:, 3], i], symmetry)))
+
+def symmetry_type(oids):
+	"""Symmetry type of a code from @param oids of rolls_key, as searched
+	by PatternLib.encode before. TIDs are numbered by first appearance of the
+	distinct codes of O1-O8."""
+	stabilizer = [oidCompose[oidInverse[oids[0]]][i] for i in oids]
+	cosets, oidTid = {}, {}
+	for i in range(8):
+		coset = min(oidCompose[i][h] for h in stabilizer)
+		oidTid[OID(i+1)] = cosets.setdefault(coset, TID(len(cosets)+1))
+	for s in range(9):
+		if oidTid == oidToTid[s]:
+			return s
+	return 0
+
+def canonical_tid(oid, oidRef, symmetryType):
+	"""TID of the instance whose code is transformed into the canonical one by
+	OID index @param oid, while the T1 code of the pattern is by @param oidRef."""
+	return oidToTid[symmetryType][OID(oidCompose[oidInverse[oid]][oidRef]+1)]
+
+
+#*********rolling code hashes*************
+# An element (x, y, pid, tid, symmetryType) contributes w(pid, tid, symmetryType)
+# * A**(2x) * B**(2y) to the hash of a pattern code modulo ROLL_PRIME. Hashes of
+# disjoint element sets add up and translating a code by (dx, dy) multiplies its
+# hash by A**(2dx) * B**(2dy), so enlargements are hashed incrementally. Rolls
+# are the 8 hashes of O1-O8 transforms of a code in absolute coordinates.
+ROLL_PRIME = 2**61 - 1
+rollBase = (0x5851f42d4c957f2d % ROLL_PRIME, 0x14057b7ef767814f % ROLL_PRIME)
+
+@lru_cache(maxsize=None)
+def _roll_weight(pid, tid, symmetryType):
+	digest = hashlib.blake2b("{},{},{}".format(pid, tid, symmetryType).encode(), digest_size=8)
+	return int.from_bytes(digest.digest(), 'little') % ROLL_PRIME
+
+@lru_cache(maxsize=1 << 16)
+def _roll_axis(v):
+	"""(A**v, A**-v, B**v, B**-v) of doubled coordinate @param v."""
+	(a, b), p = rollBase, ROLL_PRIME
+	return pow(a, v, p), pow(a, -v, p), pow(b, v, p), pow(b, -v, p)
+
+def _roll_powers(x2, y2):
+	"""A**X * B**Y of (X, Y), the O1-O8 transforms of doubled point (x2, y2)."""
+	ax, axi, bx, bxi = _roll_axis(x2)
+	ay, ayi, by, byi = _roll_axis(y2)
+	p = ROLL_PRIME
+	return (ax*by % p, axi*by % p, ayi*bx % p, ay*bx % p,
+			axi*byi % p, ax*byi % p, ay*bxi % p, ayi*bxi % p)
+
+@lru_cache(maxsize=None)
+def _roll_weights(pid, tid, symmetryType):
+	"""Weights of an element in O1-O8 transforms."""
+	return tuple(_roll_weight(pid, t, symmetryType) for t in tidTable[symmetryType, tid].tolist())
+
+def rolls_add(rolls, rolls1):
+	"""Rolls of the union of two disjoint element sets."""
+	return [(r + r1) % ROLL_PRIME for r, r1 in zip(rolls, rolls1)]
+
+def code_rolls(code):
+	"""Rolls of packed @param code."""
+	p = ROLL_PRIME
+	terms = [[w*power % p for w, power in zip(_roll_weights(pid, tid, s), _roll_powers(x2, y2))]
+			 for x2, y2, pid, tid, s in code.tolist()]
+	if not terms:
+		return [0]*8
+	return [sum(column) % p for column in zip(*terms)]
+
+def string_rolls(string):
+	"""Rolls of the 5-tuple like string, whose coordinates are multiple of 0.5."""
+	return code_rolls(code_pack(string))
+
+def rolls_key(rolls, x2, y2):
+	"""Canonical hash of the code of @param rolls centered at doubled (x2, y2),
+	which is the minimal hash of its O1-O8 transforms.
+	@return: tuple(key, indexes of the OIDs transforming the code into it)."""
+	p = ROLL_PRIME
+	hashes = [r*power % p for r, power in zip(rolls, _roll_powers(-x2, -y2))]
+	key = min(hashes)
+	return key, [i for i in range(8) if hashes[i] == key]
+
+
+#*********rectangle codes**************
+# orientations exchanging width and height of a rectangle
+rectSwap = (False, False, True, True, False, False, True, True)
+
+def rect_dims(pointList):
+	"""(w, h, counterClockwise) if @param pointList is an axis-aligned
+	rectangle, else None."""
+	if len(pointList) != 4:
+		return None
+	(x0, y0), (x1, y1), (x2, y2), (x3, y3) = pointList
+	if y0 == y1 and x1 == x2 and y2 == y3 and x3 == x0:
+		cross = (x1 - x0)*(y2 - y1)
+	elif x0 == x1 and y1 == y2 and x2 == x3 and y3 == y0:
+		cross = (x1 - x2)*(y1 - y0)
+	else:
+		return None
+	if cross == 0:
+		return None
+	return abs(x2 - x0), abs(y2 - y0), cross > 0
+
+def rects_dims(cycles):
+	"""Vectorized rect_dims of (m, 4, 2) int array @param cycles.
+	@return: tuple(mask, w, h, counterClockwise) of (m,) arrays."""
+	x, y = cycles[..., 0], cycles[..., 1]
+	horizontal = (y[:, 0] == y[:, 1]) & (x[:, 1] == x[:, 2]) & (y[:, 2] == y[:, 3]) & (x[:, 3] == x[:, 0])
+	vertical = (x[:, 0] == x[:, 1]) & (y[:, 1] == y[:, 2]) & (x[:, 2] == x[:, 3]) & (y[:, 3] == y[:, 0])
+	cross = np.where(horizontal, (x[:, 1] - x[:, 0])*(y[:, 2] - y[:, 1]),
+					 (x[:, 1] - x[:, 2])*(y[:, 1] - y[:, 0]))
+	mask = (horizontal | vertical) & (cross != 0)
+	return mask, np.abs(x[:, 2] - x[:, 0]), np.abs(y[:, 2] - y[:, 0]), cross > 0
+
+def rect_code(w, h, counterClockwise):
+	"""O1 code of the w*h rectangle, which starts at its lower left corner."""
+	if counterClockwise:
+		return [(w, 0), (w, h), (0, h)]
+	return [(0, h), (w, h), (w, 0)]
+
+def rect_orientations(w, h, counterClockwise):
+	"""Codes of O1-O8, TIDs and symmetry type of the w*h rectangle, derived
+	analytically instead of by code_transform_basic. Squares look the same in
+	all orientations, whose type is not searched by PolygonLib.encode_code and
+	is 0 as well.
+	@return: tuple(8 codes, 8 TID values, symmetryType)."""
+	codes = [rect_code(h, w, counterClockwise) if swap else rect_code(w, h, counterClockwise)
+			 for swap in rectSwap]
+	if w == h:
+		return codes, [1]*8, 0
+	return codes, [2 if swap else 1 for swap in rectSwap], 7
+
+
 #*********visualization***************
 def shapes_save(shapes, layout, cell, layerIndex):
 	"""Insert boxes in the layout for further check or visisualization.
@@ -0,0 +1,349 @@
+"""
+@version: 	0.1
+@brief:     Shared polygon ingestion stage for all managers.
+Polygons of one layer are merged, encoded and kept in columnar arrays, so that
+hierarchy manager and both array managers parse the same layer only once.
+"""
+
+import math
+import time
+from array import array
+from itertools import chain
+
+import numpy as np
+import klayout.db as db
+from layoutHier.utils.helpers import gc_paused
+from layoutHier.utils.spatial import index_build, window_build
+
+from layoutHier.utils.pattern import PolygonInstArray, PolygonPattern, PolygonLib
+
+__all__ = ["PolygonStore"]
+
+
+class PolygonStore(object):
+	"""Columnar result of layer ingestion. Polygon i is described by row i of
+	each array, and its hull is points[offsets[hull[i]]: offsets[hull[i]+1]]
+	moved to the lower left corner of bbox[i]."""
+
+	def __init__(self, bbox, pid, tid, symmetry, hull, offsets, points, polygonLib, world):
+		"""
+		@param bbox: (N, 4) int64 array of (left, bottom, right, top).
+		@param pid: (N,) int32 array of polygon pattern ids.
+		@param tid: (N,) int8 array of TID values.
+		@param symmetry: (N,) int8 array of symmetry types.
+		@param hull: (N,) int32 array indexing distinct hulls below.
+		@param offsets: (H+1,) int64 array of vertex offsets of distinct hulls.
+		@param points: (M, 2) int64 array of hull vertexes relative to the
+		lower left corner of bounding box. Polygons with the same pid and tid
+		share one hull, so memory scales with distinct geometry.
+		@param polygonLib: PolygonLib holding codes only, its patterns have no
+		instances since instances are the rows above.
+		@param world: db.Box of the whole ingested region."""
+		self.bbox = bbox
+		self.pid = pid
+		self.tid = tid
+		self.symmetry = symmetry
+		self.hull = hull
+		self.offsets = offsets
+		self.points = points
+		self.polygonLib = polygonLib
+		self.world = world
+
+	@classmethod
+	def from_layout(cls, layout, layer=0, merge=True, flatten=False, deep=False,
+					tile=None, border=0, threads=1, window=None, polygonLib=None):
+		"""Merge and encode polygons of @param layer below the top cell. The
+		layout is read through recursive shape iterator and is left unchanged
+		unless @param flatten is set.
+		@param deep: merge in a DeepShapeStore with cell tree kept and encode
+		each cell shape once per orientation, not once per placement.
+		@param tile: merge tile by tile with tile size (w, h) or w in DBU, using
+		@param threads and tile @param border, see @method _tiled_merge.
+		@param window: db.Box in DBU or db.DBox in micron, only shapes touching
+		it are read and polygons are clipped at it before encoding.
+		@param polygonLib: library to encode into, a new one if None."""
+		assert isinstance(layout, db.Layout)
+
+		if polygonLib is None:
+			polygonLib = PolygonLib([], {}, 0, type='polygon')
+		if isinstance(window, db.DBox):
+			window = window.to_itype(layout.dbu)
+		end = time.time()
+		topCell = layout.top_cell()
+		if flatten:
+			topCell.flatten(-1, False)
+			print("Flatten time is {}".format(time.time()-end))
+			end = time.time()
+		if deep:
+			iterator = cls._deep_polygons(topCell, layer, merge, window)
+		else:
+			iterator = cls._flat_polygons(topCell, layer, merge, window,
+										  tile, border, threads)
+
+		boxes, refs, counts, coords = [], [], [], array('q')
+		with gc_paused():
+			for box, vertexes, ref in iterator:
+				boxes.append((box.left, box.bottom, box.right, box.top))
+				refs.append(ref)
+				counts.append(0 if vertexes is None else len(vertexes))
+				if vertexes is not None:
+					coords.extend(chain.from_iterable(vertexes))
+		bbox = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+		counts = np.array(counts, dtype=np.int64)
+		starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+		coords = np.frombuffer(coords, dtype=np.int64).reshape(-1, 2)
+
+		# encode delivered hulls at once, cached rows copy the codes of their reference
+		refs = np.array([-1 if ref is None else ref for ref in refs], dtype=np.int64)
+		encoded = np.flatnonzero(refs < 0)
+		codes = np.zeros((len(refs), 3), dtype=np.int64)
+		codes[encoded] = np.column_stack(polygonLib.encode_batch(
+			np.append(starts[encoded], len(coords)), coords))
+		cached = np.flatnonzero(refs >= 0)
+		codes[cached] = codes[refs[cached]]
+		pid, tid, symmetry = codes[:, 0], codes[:, 1], codes[:, 2]
+
+		# polygons with the same pid and tid share the hull of the first one
+		_, firstRows, hullIds = np.unique(pid*8 + tid - 1, return_index=True, return_inverse=True)
+		order = np.argsort(firstRows)
+		rank = np.zeros(len(order), dtype=np.int64)
+		rank[order] = np.arange(len(order))
+		hullIds, firstRows = rank[hullIds.reshape(-1)], firstRows[order]
+		hullCounts = counts[firstRows]
+		offsets = np.concatenate(([0], np.cumsum(hullCounts))).astype(np.int64)
+		gather = np.repeat(starts[firstRows] - offsets[:-1], hullCounts) + np.arange(offsets[-1])
+		points = coords[gather] - np.repeat(bbox[firstRows, :2], hullCounts, axis=0)
+		print("Encode time is {}".format(time.time()-end))
+
+		world = topCell.bbox() if window is None else topCell.bbox() & window
+		store = cls(bbox, pid.astype(np.int32), tid.astype(np.int8), symmetry.astype(np.int8),
+					hullIds.astype(np.int32), offsets, points.reshape(-1, 2), polygonLib, world)
+		if deep and merge:
+			store._unique()
+		return store
+
+	@classmethod
+	def from_file(cls, path, layer, window=None, **kwargs):
+		"""Load @param layer of the layout file only and encode it, see @method
+		layout_load and @method from_layout for the params."""
+		layout, layerIndex = cls.layout_load(path, layer)
+		return cls.from_layout(layout, layerIndex, window=window, **kwargs)
+
+	@staticmethod
+	def layout_load(path, layer):
+		"""Load the layout file with other layers skipped.
+		@param layer: layer spec like '31/0', (31, 0) or db.LayerInfo.
+		@return: tuple(layout, layer index)."""
+		if isinstance(layer, str):
+			info = db.LayerInfo.from_string(layer)
+		elif isinstance(layer, (tuple, list)):
+			info = db.LayerInfo(*layer)
+		else:
+			info = layer
+		layerMap = db.LayerMap()
+		layerMap.map(info, 0)
+		options = db.LoadLayoutOptions()
+		options.set_layer_map(layerMap, False)
+		layout = db.Layout()
+		layout.read(path, options)
+		layerIndex = layout.find_layer(info)
+		if layerIndex is None:
+			raise ValueError("Layer {} is not found in {}.".format(info, path))
+		return layout, layerIndex
+
+	@staticmethod
+	def _shapes(topCell, layer, window=None):
+		"""Recursive shape iterator over the layer, restricted to @param window."""
+		if window is None:
+			return topCell.begin_shapes_rec(layer)
+		return topCell.begin_shapes_rec_overlapping(layer, window)
+
+	@staticmethod
+	def _clip(polygon, window=None):
+		"""Clip @param polygon at @param window box.
+		@return: list of polygons."""
+		if window is None or polygon.bbox().inside(window):
+			return [polygon]
+		if not polygon.bbox().overlaps(window):
+			return []
+		ep = db.EdgeProcessor()
+		return ep.boolean_p2p([polygon], [db.Polygon(window)], ep.ModeAnd, False, False)
+
+	@staticmethod
+	def _flat_polygons(topCell, layer, merge, window, tile=None,
+					   border=0, threads=1):
+		"""Yield (bbox, vertexes, None) of polygons delivered flat."""
+		end = time.time()
+		if merge and tile:
+			polygons = PolygonStore._tiled_merge(topCell, layer, tile, border, threads, window)
+			print("Merge time is {}".format(time.time()-end))
+		elif merge:
+			topRegion = db.Region(PolygonStore._shapes(topCell, layer, window))
+			topRegion.merge()
+			topRegion.merged_semantics=0
+			polygons = topRegion.each_merged()
+			print("Merge time is {}".format(time.time()-end))
+		else:
+			polygons = []
+			iterator = PolygonStore._shapes(topCell, layer, window)
+			while not iterator.at_end():
+				polygon = iterator.shape().polygon
+				if polygon is not None:
+					polygons.append(polygon.transformed(iterator.trans()))
+				iterator.next()
+
+		for polygon in polygons:
+			for piece in PolygonStore._clip(polygon, window):
+				yield piece.bbox(), [(point.x, point.y) for point in piece.each_point_hull()], None
+
+	@staticmethod
+	def _tiled_merge(topCell, layer, tile, border=0, threads=1, window=None):
+		"""Merge polygons tile by tile through TilingProcessor. Merged polygons
+		are clipped at tiles, so pieces touching tile boundaries are merged
+		once more to stitch the polygons crossing tiles back.
+		@param tile: tile size (w, h) or w for square tile in DBU.
+		@param border: tile border in DBU.
+		@param threads: number of threads working on tiles.
+		@return: merged db.Region."""
+		layout = topCell.layout()
+		dbu = layout.dbu
+		w, h = tile if isinstance(tile, (tuple, list)) else (tile, tile)
+		world = topCell.bbox_per_layer(layer)
+		if window is not None:
+			world = world & window
+		if world.empty():
+			return db.Region()
+		nx = max(1, int(math.ceil(world.width()/w)))
+		ny = max(1, int(math.ceil(world.height()/h)))
+
+		pieces = db.Region()
+		tp = db.TilingProcessor()
+		tp.input("shapes", PolygonStore._shapes(topCell, layer, window))
+		tp.output("pieces", pieces)
+		tp.dbu = dbu
+		tp.tile_origin(world.left*dbu, world.bottom*dbu)
+		tp.tile_size(w*dbu, h*dbu)
+		tp.tiles(nx, ny)
+		tp.tile_border(border*dbu, border*dbu)
+		tp.threads = threads
+		tp.queue("_output(pieces, shapes.merged, true)")
+		tp.execute("Tiled merge")
+
+		# polygons not touching tile boundaries are complete already
+		lines = db.Edges()
+		for i in range(1, nx):
+			x = world.left + i*w
+			lines.insert(db.Edge(x, world.bottom, x, world.top))
+		for j in range(1, ny):
+			y = world.bottom + j*h
+			lines.insert(db.Edge(world.left, y, world.right, y))
+		merged = pieces.not_interacting(lines)
+		merged += pieces.interacting(lines).merged()
+		merged.merged_semantics = 0
+		return merged
+
+	@staticmethod
+	def _deep_polygons(topCell, layer, merge, window):
+		"""Yield (bbox, vertexes, ref) of polygons merged hierarchically. Rows
+		are cached by (cell, polygon, orientation), vertexes are None for cached
+		ones and ref is the index of the yielded row with the same hull."""
+		dss = db.DeepShapeStore()
+		region = db.Region(PolygonStore._shapes(topCell, layer, window), dss)
+		if merge:
+			region.merge()
+		iterator, transTop = region.begin_shapes_rec()
+		rows, row = {}, 0
+		while not iterator.at_end():
+			polygon = iterator.shape().polygon
+			trans = transTop * iterator.trans()
+			key = None
+			if trans.is_ortho() and not trans.is_mag():
+				key = (iterator.cell_index(), polygon, trans.rot())
+			box = polygon.bbox().transformed(trans)
+			if window is not None and not box.inside(window):
+				polygon = polygon.transformed(trans)
+				for piece in PolygonStore._clip(polygon, window):
+					yield piece.bbox(), [(point.x, point.y) for point in piece.each_point_hull()], None
+					row += 1
+			elif key in rows:
+				yield box, None, rows[key]
+				row += 1
+			else:
+				polygon = polygon.transformed(trans)
+				if key is not None:
+					rows[key] = row
+				yield box, [(point.x, point.y) for point in polygon.each_point_hull()], None
+				row += 1
+			iterator.next()
+
+	def _unique(self):
+		"""Remove duplicate polygons and sort rows by bounding box, since the
+		same polygon might be delivered by several cells in deep mode."""
+		order = np.lexsort((self.tid, self.pid, self.bbox[:, 3], self.bbox[:, 2],
+							self.bbox[:, 1], self.bbox[:, 0]))
+		rows = np.column_stack((self.bbox, self.pid, self.tid))[order]
+		keep = np.ones(len(order), dtype=bool)
+		keep[1:] = np.any(rows[1:] != rows[:-1], axis=1)
+		order = order[keep]
+		self.bbox = self.bbox[order]
+		self.pid = self.pid[order]
+		self.tid = self.tid[order]
+		self.symmetry = self.symmetry[order]
+		self.hull = self.hull[order]
+
+	def __len__(self):
+		return len(self.pid)
+
+	def box(self, i):
+		"""Bounding box of polygon @param i as db.Box."""
+		left, bottom, right, top = self.bbox[i].tolist()
+		return db.Box(left, bottom, right, top)
+
+	def vertexes(self, i):
+		"""Hull vertexes of polygon @param i as (x, y) tuples."""
+		h = self.hull[i]
+		left, bottom = self.bbox[i, :2].tolist()
+		points = self.points[self.offsets[h]: self.offsets[h+1]].tolist()
+		return [(x+left, y+bottom) for x, y in points]
+
+	def pattern_indexes(self):
+		"""Polygon indexes grouped by pid, in ingestion order within one group.
+		@return: list whose i-th item is index array of pattern with pid i."""
+		order = np.argsort(self.pid, kind='stable')
+		bounds = np.searchsorted(self.pid[order], np.arange(self.polygonLib.patternCount+1))
+		return [order[bounds[i]: bounds[i+1]] for i in range(self.polygonLib.patternCount)]
+
+	def instances(self):
+		"""Polygon instances for the managers which work on objects, as views
+		over the rows. Each call returns new visited flags, which are not shared."""
+		return PolygonInstArray(self.bbox, self.pid, self.tid, self.symmetry)
+
+	def elements(self):
+		"""Packed 5-tuples (2*x, 2*y, pid, TID value, symmetryType) of polygon
+		centers as rows, see code_pack."""
+		bbox = self.bbox.astype(np.int64)
+		return np.column_stack((bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3],
+								self.pid, self.tid, self.symmetry)).astype(np.int64)
+
+	def polygon_lib(self, instList):
+		"""Polygon library whose patterns hold instances of @param instList,
+		which should be produced by @method instances. Codes are shared."""
+		lib = self.polygonLib
+		polygonLib = PolygonLib([], lib.codeDict, lib.patternCount, lib.type)
+		for pattern, indexes in zip(lib.patternList, self.pattern_indexes()):
+			if isinstance(instList, PolygonInstArray):
+				instL = instList.take(indexes)
+			else:
+				instL = [instList[i] for i in indexes.tolist()]
+			polygonLib.patternList.append(
+				PolygonPattern(pattern.pid, pattern.symmetryType, pattern.code, instL))
+		return polygonLib
+
+	def rtree(self):
+		"""Rtree indexing polygon bounding boxes by polygon index."""
+		return index_build(self.bbox, phase='polygon')
+
+	def search_window(self, policy=None):
+		"""Search window policy of directional nearest queries over polygon
+		bounding boxes, see window_build."""
+		return window_build(self.bbox, policy)
@@ -14,15 +14,20 @@ the geometry-based layout into (x,y,PID,TID) like layout and the auxiliary libra
 import copy
 import math
 import operator
+import time
+from itertools import compress
 
+import numpy as np
 import klayout.db as db
 from rtree import index
 
 from layoutHier.utils.helpers import *
+from layoutHier.utils.spatial import index_build, index_report, memory_usage
 from layoutHier.utils.structures import *
 
-__all__ = ["ProjectiveFeature", "PolygonInst", "PolygonPattern", "PolygonLib",\
-			"Instance", "Template", "Pattern", "PatternLib"]
+__all__ = ["ProjectiveFeature", "CodeDict", "PolygonInst", "PolygonInstView",\
+			"PolygonInstArray", "PolygonPattern", "PolygonLib", "Instance", "Template",\
+			"InstanceList", "Pattern", "PatternLib"]
 
 
 class ProjectiveFeature(object):
@@ -55,7 +60,7 @@ class ProjectiveFeature(object):
 		@param polygon: it can be a polygon instance.
 		@param mode: 'single' or 'multiple'.
 		@param axis: projection axis, 'x', 'y' or 'both'."""
-		assert isinstance(polygonList[0], PolygonInst), "Polygon must be an instance."
+		assert isinstance(polygonList[0], (PolygonInst, PolygonInstView)), "Polygon must be an instance."
 		dictX = {}
 		dictY = {}
 		for polygon in polygonList:
@@ -131,10 +136,9 @@ class ProjectiveFeature(object):
 			scale += 1
 		# analyze relations between different periodic segments ,than keep longest
 		keep, remove = [], {}
-		segmentsTree = index.Index()  # segments rtree for selection
 		periodSegments.sort(key=lambda x: x[1]-x[0], reverse=True)
-		for i, segment in enumerate(periodSegments):
-			segmentsTree.insert(i, (segment[0], 0, segment[1], 1))
+		# segments rtree for selection
+		segmentsTree = index_build([(s[0], 0, s[1], 1) for s in periodSegments])
 
 		for i, segment in enumerate(periodSegments):
 			if i in remove:
@@ -238,8 +242,65 @@ class ProjectiveFeature(object):
 		return segments
 
 
+class CodeDict(object):
+	"""Code dictionary of PolygonLib/PatternLib, codeDict[code] = [PID, TID].
+	It is keyed by 64-bit fingerprints of codes, so its memory and lookup cost
+	do not grow with pattern size. Entries refer to the codes held by patterns
+	instead of copying them, codes are compared fully only when two different
+	codes share a fingerprint, which are then kept by full code as well."""
+
+	def __init__(self, items=None):
+		self.table = {}			# fingerprint => (pid, tid, code), None on collision
+		self.collided = {}		# tuple(code) => (pid, tid, code) of collided fingerprints
+		for code, value in (items or {}).items():
+			self[code] = value
+
+	def __len__(self):
+		if not self.collided:
+			return len(self.table)
+		return sum(entry is not None for entry in self.table.values()) + len(self.collided)
+
+	def __eq__(self, other):
+		return isinstance(other, CodeDict) and self.table == other.table and \
+				self.collided == other.collided
+
+	def __contains__(self, code):
+		return self.get(code) is not None
+
+	def __getitem__(self, code):
+		value = self.get(code)
+		if value is None:
+			raise KeyError(code)
+		return value
+
+	def get(self, code, default=None):
+		key = code_fingerprint(code)
+		entry = self.table.get(key)
+		if entry is None and key in self.table:
+			entry = self.collided.get(tuple(code))
+		if entry is None:
+			return default
+		return [entry[0], entry[1]]
+
+	def __setitem__(self, code, value):
+		key = code_fingerprint(code)
+		entry = (value[0], value[1], code)
+		if key in self.table:
+			current = self.table[key]
+			if current is not None and list(current[2]) == list(code):
+				self.table[key] = entry
+				return
+			if current is not None:		# collision, both codes are kept in full
+				self.collided[tuple(current[2])] = current
+				self.table[key] = None
+			self.collided[tuple(code)] = entry
+		else:
+			self.table[key] = entry
+
+
 class PolygonInst(object):
 	"""String-based polygon which is composed of polygon ID and transformation ID."""
+	__slots__ = ('bbox', 'pid', 'tid', 'symmetryType', 'visited')
 
 	def __init__(self, bbox=None, pid=None, tid=None, symmetryType=0, visited=False):
 		"""Polygon instance class which keep some necessary infomation for
@@ -253,6 +314,89 @@ class PolygonInst(object):
 		self.visited = visited
 
 
+class PolygonInstView(object):
+	"""Row of PolygonInstArray with the attribute API of PolygonInst. Views
+	are created on access, so compare rows rather than identities."""
+	__slots__ = ('array', 'row')
+	tids = [None] + [TID(i) for i in range(1, 9)]
+
+	def __init__(self, array, row):
+		self.array = array
+		self.row = row
+
+	@property
+	def bbox(self):
+		left, bottom, right, top = self.array.bbox[self.row].tolist()
+		return db.Box(left, bottom, right, top)
+
+	@property
+	def pid(self):
+		return int(self.array.pid[self.row])
+
+	@property
+	def tid(self):
+		return self.tids[self.array.tid[self.row]]
+
+	@property
+	def symmetryType(self):
+		return int(self.array.symmetry[self.row])
+
+	@property
+	def visited(self):
+		return bool(self.array.visited[self.row])
+
+	@visited.setter
+	def visited(self, flag):
+		self.array.visited[self.row] = flag
+
+
+class PolygonInstArray(object):
+	"""Polygon instances backed by typed arrays, indexing yields PolygonInstView.
+	Arrays are shared with the PolygonStore, visited flags by all arrays taken
+	from the same one."""
+	__slots__ = ('bbox', 'pid', 'tid', 'symmetry', 'visited', 'rows')
+
+	def __init__(self, bbox, pid, tid, symmetry, visited=None, rows=None):
+		"""@param bbox, pid, tid, symmetry: rows of polygons, see PolygonStore.
+		@param visited: (N,) bool array, a new one if None.
+		@param rows: polygon rows of the items, all rows if None."""
+		self.bbox = bbox
+		self.pid = pid
+		self.tid = tid
+		self.symmetry = symmetry
+		self.visited = np.zeros(len(pid), dtype=bool) if visited is None else visited
+		self.rows = rows
+
+	def __len__(self):
+		return len(self.pid) if self.rows is None else len(self.rows)
+
+	def __getitem__(self, i):
+		if self.rows is not None:
+			i = self.rows[i]
+		elif i < 0:
+			i += len(self.pid)
+		return PolygonInstView(self, int(i))
+
+	def __iter__(self):
+		rows = range(len(self.pid)) if self.rows is None else self.rows.tolist()
+		return (PolygonInstView(self, i) for i in rows)
+
+	def take(self, rows):
+		"""Items of @param rows as a PolygonInstArray sharing the arrays."""
+		rows = np.asarray(rows, dtype=np.int64)
+		if self.rows is not None:
+			rows = self.rows[rows]
+		return PolygonInstArray(self.bbox, self.pid, self.tid, self.symmetry,
+								self.visited, rows)
+
+	def visited_reset(self):
+		"""Reset visited flags of the items to False."""
+		if self.rows is None:
+			self.visited[:] = False
+		else:
+			self.visited[self.rows] = False
+
+
 class PolygonPattern(object):
 	"""The basic element of the auxiliary library which corresponds to cluster
 	code one by one."""
@@ -303,16 +447,19 @@ class PolygonLib(object):
 	"""
 	This encapsulate a 2-dim list and a dict to realise bidirectional search.
 	patternList[PatternCount] = basic pattern,
-	codeDict[code] = [PID][TID]
+	codeDict[code] = [PID][TID], see CodeDict
 	"""
 
+	CHUNK = 1 << 20		# vertexes encoded at once by @method encode_batch
+
 	def __init__(self, patternList=[], codeDict={}, patternCount=0, type='polygon'):
 		assert(type == 'polygon' or type == 'cluster')
 
 		self.patternList = patternList
-		self.codeDict = codeDict
+		self.codeDict = codeDict if isinstance(codeDict, CodeDict) else CodeDict(codeDict)
 		self.patternCount = patternCount      #indicating the pattern number in lib
 		self.type = type
+		self.rectTable = {}		# (w, h, counterClockwise) => (pid, tid, symmetryType)
 
 	def encode(self, bbox, pointList):
 		"""
@@ -322,8 +469,23 @@ class PolygonLib(object):
 		@param pointList: point list of the encoding instance,its order is
 		counter-clockwise for polygon or lexicographically ordered for cluster.
 		"""
+		code = self.encode_code(pointList)
+		if code is None:
+			return
+		pid, tid, symmetry = code
+		inst = PolygonInst(bbox, pid, tid, symmetry)
+		self.patternList[pid].insert(inst)
+		return inst
+
+	def encode_code(self, pointList):
+		"""Same as @method encode but no instance is created, which is used by
+		columnar storage like PolygonStore.
+		@return: tuple(pid, tid, symmetryType)."""
 		# sort as need
 		if self.type == 'polygon':
+			rect = rect_dims(pointList)
+			if rect is not None:
+				return self.rect_encode(*rect)
 			length = len(pointList)
 			lableMin = 0
 			for i in range(length):
@@ -346,56 +508,180 @@ class PolygonLib(object):
 			code1.append(  (pointList[i][0] - pointList[0][0], pointList[i][1] - pointList[0][1]) )
 
 		# check if the O1 code exists in library
-		if tuple(code1) in self.codeDict:	# hush map for quick enqury for dictionary
-			# add the instance to the corresponding pattern
-			pid = self.codeDict.get(tuple(code1))[0]
-			tid = self.codeDict.get(tuple(code1))[1]
-			symmetry = self.patternList[pid].symmetryType
-			inst = PolygonInst(bbox, pid, tid, symmetry)
-			self.patternList[pid].insert(inst)
-		else:
-			codeList = list()
-			codeList.append(code1)                         #for O1
-			codeList.append(code_transform_basic(code1, O2, self.type))     #for O2
-			codeList.append(code_transform_basic(code1, O3, self.type))     #for O3
-			codeList.append(code_transform_basic(code1, O4, self.type))     #for O4
-			codeList.append(code_transform_basic(code1, O5, self.type))     #for O5
-			codeList.append(code_transform_basic(code1, O6, self.type))     #for O6
-			codeList.append(code_transform_basic(code1, O7, self.type))     #for O7
-			codeList.append(code_transform_basic(code1, O8, self.type))     #for O8
-
-			dict = {}						# oidTotid of the current cluster
-			tidCodeList = [code1]			# tid related cluster code
-			for i in range(8):				# get the oid-to-tid relation
-				length = len(tidCodeList)
-				for j in range(length):
-					if codeList[i] == tidCodeList[j]:
-						dict[OID(i + 1)] = TID(j + 1)
-						break
-					if j == length - 1:
-						dict[OID(i + 1)] = TID(length + 1)
-						tidCodeList.append(codeList[i])
-
-			# obtain the symmetry of the cluster
-			symmetryType = 0
-			for i in range(8):
-				if operator.eq(dict, oidToTid[i]):
-					symmetryType = i
-					break
+		code = self.codeDict.get(code1)		# hush map for quick enqury for dictionary
+		if code is not None:
+			pid, tid = code
+			return pid, tid, self.patternList[pid].symmetryType
 
-			# assign the pattern library number
-			pid = self.patternCount			# PID range from 0
-			self.patternCount += 1			# update
+		codeList = list()
+		codeList.append(code1)                         #for O1
+		codeList.append(code_transform_basic(code1, O2, self.type))     #for O2
+		codeList.append(code_transform_basic(code1, O3, self.type))     #for O3
+		codeList.append(code_transform_basic(code1, O4, self.type))     #for O4
+		codeList.append(code_transform_basic(code1, O5, self.type))     #for O5
+		codeList.append(code_transform_basic(code1, O6, self.type))     #for O6
+		codeList.append(code_transform_basic(code1, O7, self.type))     #for O7
+		codeList.append(code_transform_basic(code1, O8, self.type))     #for O8
+
+		dict = {}						# oidTotid of the current cluster
+		tidCodeList = [code1]			# tid related cluster code
+		for i in range(8):				# get the oid-to-tid relation
+			length = len(tidCodeList)
+			for j in range(length):
+				if codeList[i] == tidCodeList[j]:
+					dict[OID(i + 1)] = TID(j + 1)
+					break
+				if j == length - 1:
+					dict[OID(i + 1)] = TID(length + 1)
+					tidCodeList.append(codeList[i])
+
+		# obtain the symmetry of the cluster
+		symmetryType = 0
+		for i in range(8):
+			if operator.eq(dict, oidToTid[i]):
+				symmetryType = i
+				break
+
+		# assign the pattern library number
+		pid = self.patternCount			# PID range from 0
+		self.patternCount += 1			# update
+
+		# update the pattern library
+		pattern = PolygonPattern(pid, symmetryType, tidCodeList, [])
+		for i in range(len(tidCodeList)):
+			x = tidCodeList[i]
+			self.codeDict[x] = [pid, TID(i+1)]     # update code dictionary
+		self.patternList.append(pattern)                    # update pattern list
+
+		return pid, T1, symmetryType
+
+	def rect_encode(self, w, h, counterClockwise):
+		"""Fast path of @method encode_code for axis-aligned rectangles, which
+		are keyed by their dimensions in the rectangle table.
+		@return: tuple(pid, tid, symmetryType)."""
+		key = (w, h, counterClockwise)
+		code = self.rectTable.get(key)
+		if code is not None:
+			return code
+		codeList, tids, symmetryType = rect_orientations(w, h, counterClockwise)
+		code = self.codeDict.get(codeList[0])
+		if code is not None:
+			pid, tid = code
+			code = (pid, tid, self.patternList[pid].symmetryType)
+		else:
+			code = (self.__pattern_add(codeList, tids, symmetryType), T1, symmetryType)
+		self.rectTable[key] = code
+		return code
+
+	def __pattern_add(self, codeList, tids, symmetryType):
+		"""Add the pattern of 8 codes @param codeList with TID values @param tids.
+		@return: pid."""
+		tidCodeList = [codeList[i] for i in range(8) if tids[i] not in tids[:i]]
+		pid = self.patternCount
+		self.patternCount += 1
+		for i, code in enumerate(tidCodeList):
+			self.codeDict[code] = [pid, TID(i+1)]
+		self.patternList.append(PolygonPattern(pid, symmetryType, tidCodeList, []))
+		return pid
+
+	def encode_batch(self, offsets, points):
+		"""Vectorized @method encode_code of polygons. Polygons are grouped by
+		vertex count and rotated as arrays, than the 8 orientations are derived
+		for distinct new shapes only. Pids are assigned in polygon order as if
+		they were encoded one by one.
+		@param offsets: (N+1,) int array, hull of polygon i is points[offsets[i]:
+		offsets[i+1]] in counter-clockwise order.
+		@param points: (M, 2) int array of vertexes.
+		@return: tuple(pid, tid, symmetryType) of (N,) int arrays, tid holds TID values."""
+		assert self.type == 'polygon', "Batch encoding is for polygon only."
+		offsets = np.asarray(offsets)
+		points = np.ascontiguousarray(points, dtype=np.int64).reshape(-1, 2)
+		points = points.view(np.complex128)[:, 0]	# gather vertexes as 16-byte items
+		counts = np.diff(offsets)
+		shapes, inverses = [], []	# (first polygon, 8 codes, tids, symmetry, rect), group index
+		for n in np.unique(counts).tolist():
+			idx = np.flatnonzero(counts == n)
+			if n == 4:	# rectangles are keyed by their dimensions
+				cycles = points[offsets[idx][:, None] + np.arange(4)].view(np.int64).reshape(-1, 4, 2)
+				mask, w, h, counterClockwise = rects_dims(cycles)
+				rects, idx = idx[mask], idx[~mask]
+				w, h, counterClockwise = w[mask], h[mask], counterClockwise[mask]
+				height = int(h.max()) + 1 if len(h) else 1
+				if len(w) and (int(w.max()) + 1)*height < 2**61:	# dimensions as one integer
+					_, first, inverse = np.unique((w*height + h)*2 + counterClockwise,
+												  return_index=True, return_inverse=True)
+				else:
+					_, first, inverse = np.unique(np.column_stack((w, h, counterClockwise)), axis=0,
+												  return_index=True, return_inverse=True)
+				base = len(shapes)
+				for f in first.tolist():
+					rect = (int(w[f]), int(h[f]), bool(counterClockwise[f]))
+					shapes.append((rects[f],) + rect_orientations(*rect) + (rect,))
+				inverses.append((rects, base + inverse.reshape(-1)))
+				if len(idx) == 0:
+					continue
+			step = max(1, PolygonLib.CHUNK//n)
+			# distinct codes by 64-bit hashes, each code is compared with its representative
+			reps, first, codes = {}, [], []		# hash => distinct index, first polygon, code
+			inverse = np.zeros(len(idx), dtype=np.int64)
+			collision = False
+			for i in range(0, len(idx), step):
+				chunk = self.__codes(offsets, points, idx[i: i+step])
+				hashes, chunkFirst, chunkInverse = np.unique(code_hashes(chunk), return_index=True,
+															 return_inverse=True)
+				distinct = np.zeros(len(hashes), dtype=np.int64)
+				for j, (key, f) in enumerate(zip(hashes.tolist(), chunkFirst.tolist())):
+					if key not in reps:
+						reps[key] = len(codes)
+						first.append(i + f)
+						codes.append(chunk[f])
+					distinct[j] = reps[key]
+				chunkInverse = chunkInverse.reshape(-1)
+				represent = np.stack([codes[d] for d in distinct.tolist()])
+				collision = collision or not np.array_equal(chunk, represent[chunkInverse])
+				inverse[i: i+len(chunk)] = distinct[chunkInverse]
+			codes, first = np.stack(codes), np.array(first)
+			if collision:	# compare codes fully
+				codes = np.concatenate([self.__codes(offsets, points, idx[i: i+step])
+										for i in range(0, len(idx), step)])
+				codes, first, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+				inverse = inverse.reshape(-1)
+			codes8 = dihedral_codes(codes.reshape(len(codes), n-1, 2))
+			tids, symmetries = dihedral_tids(codes8)
+			codes8, tids, symmetries = codes8.tolist(), tids.tolist(), symmetries.tolist()
+			base = len(shapes)
+			for u in range(len(codes)):
+				shapes.append((idx[first[u]], [[tuple(p) for p in c[u]] for c in codes8],
+							   tids[u], symmetries[u], None))
+			inverses.append((idx, base + inverse))
+
+		# encode distinct shapes in the order of their first polygons
+		results = [None]*len(shapes)
+		for u in sorted(range(len(shapes)), key=lambda u: shapes[u][0]):
+			_, codes8, tids, symmetryType, rect = shapes[u]
+			code = self.codeDict.get(codes8[0])
+			if code is not None:
+				pid, tid = code
+				code = (pid, tid, self.patternList[pid].symmetryType)
+			else:
+				code = (self.__pattern_add(codes8, tids, symmetryType), T1, symmetryType)
+			if rect is not None:
+				self.rectTable[rect] = code
+			results[u] = (code[0], code[1].value, code[2])
 
-			# update the pattern library
-			inst = PolygonInst(bbox, pid, T1, symmetryType)
-			pattern = PolygonPattern(pid, symmetryType, tidCodeList, [inst])
-			for i in range(len(tidCodeList)):
-				x = tidCodeList[i]
-				self.codeDict[ tuple(x) ] = [pid, TID(i+1)]     # update code dictionary
-			self.patternList.append(pattern)                    # update pattern list
+		encoded = np.zeros((len(counts), 3), dtype=np.int64)
+		results = np.array(results, dtype=np.int64).reshape(-1, 3)
+		for idx, inverse in inverses:
+			encoded[idx] = results[inverse]
+		return encoded[:, 0], encoded[:, 1], encoded[:, 2]
 
-		return inst
+	@staticmethod
+	def __codes(offsets, points, idx):
+		"""O1 codes of polygons @param idx with the same vertex count as rows,
+		@param points are 16-byte vertexes."""
+		n = int(offsets[idx[0]+1] - offsets[idx[0]]) if len(idx) else 1
+		cycles = points[offsets[idx][:, None] + np.arange(n)].view(np.int64).reshape(len(idx), n, 2)
+		return polygon_codes(cycles).reshape(len(idx), -1)
 
 
 class Template(object):
@@ -432,18 +718,32 @@ class Template(object):
 
 class Instance(object):
 	"""Instance of the repeating pattern."""
+	__slots__ = ('bbox', 'pid', 'tid', 'pattern', '__childInsts', 'rolls')
 
-	def __init__(self, bbox=None, pid=None, tid=None, pattern=None, ci=[]):
+	def __init__(self, bbox=None, pid=None, tid=None, pattern=None, ci=None, rolls=None):
+		"""@param ci: list of child instances, created on first access if None.
+		@param rolls: rolls of elements inside the instance, see code_rolls."""
 		self.bbox = bbox
 		self.pid = pid
 		self.tid = tid
 		self.pattern = pattern
-		self.childInsts = ci
+		self.__childInsts = ci
+		self.rolls = rolls
+
+	@property
+	def childInsts(self):
+		if self.__childInsts is None:
+			self.__childInsts = []
+		return self.__childInsts
+
+	@childInsts.setter
+	def childInsts(self, ci):
+		self.__childInsts = ci
 
 	@classmethod
 	def deepcopy(cls, inst):
 		box = db.Box(inst.bbox)
-		return cls(box, inst.pid, inst.tid, inst.pattern)
+		return cls(box, inst.pid, inst.tid, inst.pattern, rolls=inst.rolls)
 
 	def __eq__(self, inst):
 		if self.bbox.left==inst.bbox.left and self.bbox.bottom==inst.bbox.bottom:
@@ -460,28 +760,227 @@ class Instance(object):
 			return False
 
 
+class InstanceList(object):
+	"""Instances of a pattern sorted by (left, bottom) of their bounding boxes,
+	which are unique. Bounding boxes are kept in arrays sorted by packed
+	(left, bottom) keys for O(log n) lookup. Inserted and removed instances
+	are buffered and merged into the arrays at once on the next read.
+	@member rtree indexes the instances by ids kept over insertions and
+	removals, so that it is updated per instance once built, and @method
+	intersection gives positions of the instances found."""
+	__slots__ = ('__insts', '__bbox', '__keys', '__ids', '__positions', '__pending',
+				 '__removed', '__rtree', '__count')
+
+	def __init__(self, insts=()):
+		self.__insts = []
+		self.__bbox = np.zeros((0, 4), dtype=np.int64)
+		self.__keys = np.zeros(0, dtype=np.int64)
+		self.__ids = np.zeros(0, dtype=np.int64)	# position => id in @member rtree
+		self.__positions = None	# id => position, -1 for removed ids, derived on first query
+		self.__pending = {}		# key => (id, instance) not merged yet
+		self.__removed = set()	# positions of merged instances removed
+		self.__rtree = None
+		self.__count = 0		# ids given
+		self.extend(insts)
+
+	def __len__(self):
+		return len(self.__insts) + len(self.__pending) - len(self.__removed)
+
+	def __iter__(self):
+		self.__merge()
+		return iter(self.__insts)
+
+	def __getitem__(self, i):
+		self.__merge()
+		return self.__insts[i]
+
+	def __contains__(self, inst):
+		return self.__find(InstanceList.__key(inst.bbox)) is not None
+
+	@staticmethod
+	def __key(box):
+		"""(left, bottom) of @param box packed into one int64, ordered alike,
+		since coordinates are 32 bits."""
+		return (box.left << 32) + box.bottom + (1 << 31)
+
+	def __find(self, key):
+		"""Instance at packed @param key if any."""
+		item = self.__pending.get(key)
+		if item is not None:
+			return item[1]
+		i = self.__position(key)
+		return None if i < 0 or i in self.__removed else self.__insts[i]
+
+	def __position(self, key):
+		"""Position of the merged instance at packed @param key, -1 if none."""
+		i = int(np.searchsorted(self.__keys, key))
+		return i if i < len(self.__keys) and self.__keys[i] == key else -1
+
+	def __merge(self):
+		"""Merge buffered insertions and removals into the sorted arrays."""
+		if not self.__pending and not self.__removed:
+			return
+		insts, bbox, keys, ids = self.__insts, self.__bbox, self.__keys, self.__ids
+		if self.__removed:
+			removed = sorted(self.__removed)
+			bbox, keys, ids = (np.delete(a, removed, axis=0) for a in (bbox, keys, ids))
+			if len(removed) < 64:	# a few moves of the list are cheaper than a pass
+				insts = insts[:]
+				for i in reversed(removed):
+					del insts[i]
+			else:
+				keep = np.ones(len(insts), dtype=bool)
+				keep[removed] = False
+				insts = list(compress(insts, keep.tolist()))
+		if self.__pending:
+			added = sorted(self.__pending)
+			items = [self.__pending[key] for key in added]
+			places = np.searchsorted(keys, added)
+			bbox = np.insert(bbox, places, [box_tuple(inst.bbox) for _, inst in items], axis=0)
+			keys = np.insert(keys, places, added)
+			ids = np.insert(ids, places, [id for id, _ in items])
+			merged, start = [], 0
+			for place, (_, inst) in zip(places.tolist(), items):
+				merged.extend(insts[start: place])
+				merged.append(inst)
+				start = place
+			merged.extend(insts[start:])
+			insts = merged
+		self.__insts, self.__bbox, self.__keys, self.__ids = insts, bbox, keys, ids
+		self.__pending, self.__removed, self.__positions = {}, set(), None
+
+	def insert(self, inst):
+		"""Insert @param inst unless an instance at the same place exists.
+		@return: True if inserted."""
+		key = InstanceList.__key(inst.bbox)
+		if self.__find(key) is not None:
+			return False
+		self.__pending[key] = (self.__count, inst)
+		if self.__rtree is not None:
+			self.__rtree.insert(self.__count, box_tuple(inst.bbox))
+		self.__count += 1
+		return True
+
+	append = insert
+
+	def extend(self, insts):
+		for inst in insts:
+			self.insert(inst)
+
+	def index(self, inst):
+		self.__merge()
+		i = self.__position(InstanceList.__key(inst.bbox))
+		if i < 0:
+			raise ValueError("Instance is not in the list.")
+		return i
+
+	def remove(self, inst):
+		"""Remove the instance at the same place as @param inst."""
+		key = InstanceList.__key(inst.bbox)
+		item = self.__pending.pop(key, None)
+		if item is None:
+			i = self.__position(key)
+			if i < 0 or i in self.__removed:
+				raise ValueError("Instance is not in the list.")
+			self.__removed.add(i)
+			item = (int(self.__ids[i]), self.__insts[i])
+		if self.__rtree is not None:
+			self.__rtree.delete(item[0], box_tuple(item[1].bbox))
+
+	def boxes(self):
+		"""(N, 4) array of bounding boxes in the order of instances."""
+		self.__merge()
+		return self.__bbox
+
+	@property
+	def rtree(self):
+		"""Spatial index of bounding boxes by instance id, see @method intersection."""
+		if self.__rtree is None:
+			self.rtree_update()
+		return self.__rtree
+
+	def rtree_update(self):
+		"""Bulk load @member rtree again."""
+		self.__rtree = index_build(self.boxes(), self.__ids)
+
+	def intersection(self, coordinates):
+		"""Positions of the instances whose boxes intersect with @param
+		coordinates in ascending order."""
+		ids = list(self.rtree.intersection(coordinates))
+		if not ids:
+			return []
+		self.__merge()
+		if self.__positions is None:
+			self.__positions = np.full(self.__count, -1, dtype=np.int64)
+			self.__positions[self.__ids] = np.arange(len(self.__ids))
+		return sorted(self.__positions[ids].tolist())
+
+	def __getstate__(self):
+		"""Pickled without ids and @member rtree, which is built again on first use."""
+		self.__merge()
+		return self.__insts, self.__bbox
+
+	def __setstate__(self, state):
+		self.__insts, self.__bbox = state
+		self.__keys = (self.__bbox[:, 0] << 32) + self.__bbox[:, 1] + (1 << 31)
+		self.__ids = np.arange(len(self.__insts), dtype=np.int64)
+		self.__positions, self.__pending, self.__removed = None, {}, set()
+		self.__rtree, self.__count = None, len(self.__insts)
+
+
 class Pattern(object):
 	"""
 	Repeating pattern offers following metholds；
 	@Return the 5-tuple like string when instance given;
+	Only the packed T1 code is kept in @member code, see code_pack. 5-tuple like
+	codes of all TIDs are derived by @method orientation_code.
+	@member cell is created on first use, so that transient patterns of encoding
+	cost their code and instances only. Instances are kept by InstanceList.
 	"""
+	__slots__ = ('pid', 'symmetryType', 'code', 'instList', 'polygonList', 'childPatterns',
+				 '__cell', 'cell_build', '__instFlag', '__canonical')
 
 	def __init__(self, pid = None, symmetryType = None, code = [], instList = [],
-	 			polygonList = [], childPatterns = []):
+	 			polygonList = [], childPatterns = [], canonical = None):
 		"""polygonList param is used to record the polygons making up pattern.
 		@param polygonList: polygons composing the pattern.
 		@param childPatterns: largest patterns whose part instances are covered
-		by the pattern"""
+		by the pattern
+		@param canonical: result of @method canonical if known"""
 		self.pid = pid
 		self.symmetryType = symmetryType
 		self.code = code
-		self.instList = instList
+		self.instList = instList if isinstance(instList, InstanceList) else InstanceList(instList)
 		self.polygonList = polygonList
 		self.childPatterns = childPatterns
-		self.rtree = index.Index()
-		self.cell = db.Cell()	# comresponding to pattern
+		self.__cell = None	# comresponding to pattern
 		self.cell_build = False
-		self.__instFlag = {}
+		self.__instFlag = None
+		self.__canonical = canonical
+
+	@property
+	def rtree(self):
+		return self.instList.rtree
+
+	@property
+	def cell(self):
+		if self.__cell is None:
+			self.__cell = db.Cell()
+		return self.__cell
+
+	@cell.setter
+	def cell(self, cell):
+		self.__cell = cell
+
+	def __getstate__(self):
+		"""Pickled without @member cell, which belongs to the layout."""
+		return (self.pid, self.symmetryType, self.code, self.instList, self.polygonList,
+				self.childPatterns, self.__instFlag, self.__canonical)
+
+	def __setstate__(self, state):
+		(self.pid, self.symmetryType, self.code, self.instList, self.polygonList,
+		 self.childPatterns, self.__instFlag, self.__canonical) = state
+		self.__cell, self.cell_build = None, False
 
 	def __len__(self):
 		return len(self.instList)
@@ -495,13 +994,8 @@ class Pattern(object):
 		"""convert basic pattern(polygon) into repeating pattern."""
 		pid = basicPattern.pid
 		symmetryType = basicPattern.symmetryType
-		codeList = list()
-		instL = list()
-		for i in range(len(tidToOid[symmetryType])):
-			codeList.append( [(0, 0, pid, TID(i+1), symmetryType)] )
-		for inst in basicPattern.instList:
-			instL.append(Instance(inst.bbox, pid, inst.tid, ci=[]))
-		instL.sort(key = lambda x: (x.bbox.left, x.bbox.bottom))
+		codeList = [code_pack([(0, 0, pid, T1, symmetryType)])]
+		instL = InstanceList(Instance(inst.bbox, pid, inst.tid) for inst in basicPattern.instList)
 		return cls(pid, symmetryType, codeList, instL)
 
 	@classmethod
@@ -515,9 +1009,26 @@ class Pattern(object):
 	def area(self):
 		return self.instList[0].bbox.area()*len(self)
 
+	def canonical(self):
+		"""Canonical hash of the pattern code and the OID index transforming
+		the T1 code into the canonical orientation, see rolls_key."""
+		if self.__canonical is None:
+			key, oids = rolls_key(code_rolls(self.code[0]), 0, 0)
+			self.__canonical = (key, oids[0])
+		return self.__canonical
+
+	def canonical_code(self):
+		"""Packed code in the canonical orientation, which patterns of the
+		same canonical hash are told apart by."""
+		return code_orient(self.code[0], self.canonical()[1])
+
+	def orientation_code(self, tid):
+		"""5-tuple like code of instances with @param tid, derived from the T1 code."""
+		return code_unpack(code_orient(self.code[0], tidToOid[self.symmetryType][tid].value-1))
+
 	def inside(self, inst):
 		"""Assert if an instance is inside the pattern."""
-		overlappings = list(self.rtree.intersection(box_tuple(inst.bbox)))
+		overlappings = self.instList.intersection(box_tuple(inst.bbox))
 		if len(overlappings) == 1:
 			return inst.bbox.inside(self.instList[overlappings[0]].bbox)
 		else:
@@ -532,7 +1043,7 @@ class Pattern(object):
 		"""
 		for inst in upper.instList:
 			box = inst.bbox
-			touches = list(self.rtree.intersection(box_tuple(box)))
+			touches = self.instList.intersection(box_tuple(box))
 			if touches:
 				insideFlag = True
 				for i in touches:
@@ -551,19 +1062,22 @@ class Pattern(object):
 
 	def remainings(self):
 		"""Iterate over instances which do not appear in the @member instFlag."""
+		instFlag = self.__instFlag or {}
 		for i in range(len(self)):
-			if i not in self.__instFlag:
+			if i not in instFlag:
 				yield self.instList[i]
 
 	def instFlag_update(self, indexes):
 		"""Update @member instFlag."""
 		assert isinstance(indexes, (list, tuple)), "{} should be list or tuple.".format(indexes)
+		if self.__instFlag is None:
+			self.__instFlag = {}
 		for i in indexes:
 			self.__instFlag[i] = 0
 
 	def rtree_update(self):
-		for i, inst in enumerate(self.instList):
-			self.rtree.insert(i, box_tuple(inst.bbox))
+		"""Bulk load @member rtree from all instances."""
+		self.instList.rtree_update()
 
 	def pid_update(self, newPid):
 		"""update pid with new pid when pattern is inserted into a new pattern library."""
@@ -573,7 +1087,8 @@ class Pattern(object):
 
 	def is_same(self, pattern):
 		"""check both code and instance list."""
-		if self.code == pattern.code:		# pattern code is sorted
+		if len(self.code) == len(pattern.code) and all(np.array_equal(c, c1) for c, c1 in
+				zip(self.code, pattern.code)):		# pattern code is sorted
 			length = len(self.instList)
 			return True
 		else:
@@ -592,25 +1107,7 @@ class Pattern(object):
 
 	def insert(self, instance):
 		"""insert a existing instance to the corresponding pattern with it's uniqueness checking."""
-		# maintain the order
-		right = len(self.instList)-1
-		left = 0
-		while True:
-			if left == right:
-				if instance == self.instList[left]:
-					pass
-				elif instance < self.instList[left]:
-					self.instList.insert(left, instance)
-				else:
-					self.instList.insert(left+1, instance)
-				return
-			middle = (left+right)//2
-			if instance == self.instList[middle]:
-				return
-			elif instance < self.instList[middle]:
-				left, right = left, max(middle-1,left)
-			else:
-				left, right = middle+1, right
+		self.instList.insert(instance)
 
 	def restore(self, instance):
 		if instance.pid != self.pid:
@@ -619,7 +1116,7 @@ class Pattern(object):
 		centerx = (instance.bbox.left + instance.bbox.right)/2
 		centery = (instance.bbox.bottom + instance.bbox.top)/2
 		instString = list()
-		for ele in self.code[instance.tid.value - 1]:
+		for ele in self.orientation_code(instance.tid):
 			instString.append((ele[0]+centerx, ele[1]+centery, ele[2], ele[3], ele[4]))
 		return instString
 
@@ -630,120 +1127,202 @@ class Pattern(object):
 class PatternLib(object):
 	"""
 	Repeating pattern library includes set of repeating patterns and map between code and PID/TID.
+	Patterns are keyed by the canonical hashes of their codes, codeDict[
+	canonical hash] = [PID, index of the OID transforming the T1 code into the
+	canonical orientation], see rolls_key. Hashes are composable, so that
+	rolls of an enlarged instance are derived without its code. Canonical
+	codes are kept by hash as well and compared with the code of every
+	instance found, so that different codes sharing a hash are kept apart as
+	collided patterns instead of being merged, and are counted in
+	@member collisions.
 	"""
 
 	def __init__(self, patternList = [], codeDict = {}, patternCount = 0):
 		self.patternList = patternList			# PID equal the index
 		self.codeDict = codeDict
 		self.patternCount = patternCount
+		self.__includeIndex = {}	# instance count => (rtree, [(position, instance)])
+		self.__includeList = None	# patternList indexed in @member includeIndex
+		self.__includeCount = 0
+		self.__codes = {}			# canonical hash => [(canonical code, [PID, OID index], codes by OID)]
+		self.collisions = 0			# patterns registered with a hash taken
 
 	def __iter__(self):
 		for p in self.patternList:
 			yield p
 
+	def __getstate__(self):
+		"""Pickled without @member includeIndex, which is built again on first use."""
+		return self.patternList, self.codeDict, self.patternCount, self.__codes, self.collisions
+
+	def __setstate__(self, state):
+		self.__init__(*state[:3])
+		self.__codes, self.collisions = state[3:]
+
 	@classmethod
 	def from_basic(cls, basicLib):
 		patternL = list()
 		codeD = {}
 		for pattern in basicLib.patternList:
 			patternL.append(Pattern.from_basic(pattern))
-			for i in range(len(tidToOid[pattern.symmetryType])):
-				codeD[((0, 0, pattern.pid, TID(i+1), pattern.symmetryType))] = [pattern.pid, TID(i+1)]
+			key, oidRef = patternL[-1].canonical()
+			codeD[key] = [pattern.pid, oidRef]
 		return cls(patternL, codeD, basicLib.patternCount)
 
-	def encode(self, instString, bbox):
+	def encode(self, instString, bbox, rolls=None):
 		"""encode the 5-tuple like string as the pattern and instance.
 		   (centerx, centery, inst.pid, inst.tid, inst.symmetryType)
+		@param instString: the string or its packed code, see code_pack. It can
+		be a function returning them if @param rolls of the string are given,
+		which is called for new patterns only.
 		"""
+		code = None
+		if rolls is None:
+			code = PatternLib.__packed(instString)
+			rolls = code_rolls(code)
 		# check if the pattern exists in library
-		instString.sort(key = lambda x: (x[0], x[1], x[2], x[3].value))
-		centerx = (bbox.left + bbox.right)/2
-		centery = (bbox.bottom + bbox.top)/2
-		code1 = list()
-		for ele in instString:
-			code1.append((ele[0]-centerx, ele[1]-centery, ele[2], ele[3], ele[4]))	# translation invariant
-		if tuple(code1) in self.codeDict:	# hush map for quick enqury for dictionary
+		x2, y2 = bbox.left + bbox.right, bbox.bottom + bbox.top
+		key, oids = rolls_key(rolls, x2, y2)
+		entry, code1 = None, None
+		if key in self.codeDict:		# hush map for quick enqury for dictionary
+			if code is None:
+				code = PatternLib.__packed(instString)
+			code1 = code_sort(code - np.array([x2, y2, 0, 0, 0]))	# translation invariant
+			entry, oid = self.__find(key, oids, code1)
+		if entry is not None:
 			# add the instance to the corresponding pattern
-			pid = self.codeDict.get(tuple(code1))[0]
-			inst = Instance(bbox, pid, self.codeDict.get(tuple(code1))[1], self.patternList[pid],ci=[])
-			self.patternList[pid].insert(inst)
-		else:
-			codeList = list()
-			codeList.append(code1)                         #for O1
-			codeList.append(code_transform(code1, O2))     #for O2
-			codeList.append(code_transform(code1, O3))     #for O3
-			codeList.append(code_transform(code1, O4))     #for O4
-			codeList.append(code_transform(code1, O5))     #for O5
-			codeList.append(code_transform(code1, O6))     #for O6
-			codeList.append(code_transform(code1, O7))     #for O7
-			codeList.append(code_transform(code1, O8))     #for O8
-
-			dict = {}						# oidTotid of the current cluster
-			tidCodeList = [code1]			# tid related cluster code
-			for i in range(8):				# get the oid-to-tid relation
-				length = len(tidCodeList)
-				for j in range(length):
-					if codeList[i] == tidCodeList[j]:
-						dict[OID(i + 1)] = TID(j + 1)
-						break
-					if j == length - 1:
-						dict[OID(i + 1)] = TID(length + 1)
-						tidCodeList.append(codeList[i])
-
-			# obtain the symmetry of the cluster
-			symmetryType = 0
-			for i in range(8):
-				if operator.eq(dict, oidToTid[i]):
-					symmetryType = i
-					break
+			pid, oidRef = entry
+			pattern = self.patternList[pid]
+			tid = canonical_tid(oid, oidRef, pattern.symmetryType)
+			inst = Instance(bbox, pid, tid, pattern, rolls=rolls)
+			pattern.insert(inst)
+			return inst
+
+		if code1 is None:
+			if code is None:
+				code = PatternLib.__packed(instString)
+			code1 = code_sort(code - np.array([x2, y2, 0, 0, 0]))
+
+		# obtain the symmetry of the cluster, orientations of equal hashes are
+		# checked by their codes
+		canonicalCode = code_orient(code1, oids[0])
+		oids = [i for i in oids if i == oids[0] or np.array_equal(code_orient(code1, i), canonicalCode)]
+		symmetryType = symmetry_type(oids)
+
+		# assign the pattern library number
+		pid = self.patternCount			# PID range from 0
+		self.patternCount += 1			# update
+
+		# update the pattern library
+		box = db.Box(bbox)
+		inst = Instance(box, pid, T1, rolls=rolls)
+		pattern = Pattern(pid, symmetryType, [code1], [inst], [], [], (key, oids[0]))
+		inst.pattern = pattern
+		self.__register(key, canonicalCode, [pid, oids[0]])	#update code dictionary
+		self.patternList.append(pattern)                    #update pattern list
 
-			# assign the pattern library number
-			pid = self.patternCount			# PID range from 0
-			self.patternCount += 1			# update
+		return inst
 
-			# update the pattern library
-			box = db.Box(bbox)
-			inst = Instance(box, pid, T1, ci=[])
-			pattern = Pattern(pid, symmetryType, tidCodeList, [inst], [], [])
-			inst.pattern = pattern
-			for i in range(len(tidCodeList)):
-				x = tidCodeList[i]
-				self.codeDict[ tuple(x) ] = [pid, TID(i+1)]     #update code dictionary
-			self.patternList.append(pattern)                    #update pattern list
+	def __candidates(self, key):
+		"""(canonical code, [PID, OID index], codes by OID) of patterns with
+		canonical hash @param key, codes of patterns registered through
+		@member codeDict only are derived on first use."""
+		candidates = self.__codes.get(key)
+		if candidates is None:
+			pid, oidRef = self.codeDict[key]
+			candidates = [(code_orient(self.patternList[pid].code[0], oidRef), [pid, oidRef], {})]
+			self.__codes[key] = candidates
+		return candidates
+
+	def __find(self, key, oids, code):
+		"""Entry [PID, OID index] of the pattern with canonical hash @param key
+		whose canonical code is sorted @param code transformed by one of
+		@param oids, and that OID index. None for the entry if there is none.
+		Canonical codes are transformed back by each OID once, so that codes
+		found are compared without being transformed."""
+		for canonicalCode, entry, codes in self.__candidates(key):
+			for oid in oids:
+				if oid not in codes:
+					codes[oid] = code_orient(canonicalCode, oidInverse[oid])
+				if np.array_equal(code, codes[oid]):
+					return entry, oid
+		return None, oids[0]
+
+	def __register(self, key, canonicalCode, entry):
+		"""Register @param entry of a pattern by its canonical hash and code.
+		A hash taken by another code is a collision, whose patterns are kept
+		apart by their codes."""
+		if key in self.codeDict:
+			if any(np.array_equal(canonicalCode, c) for c, _, _ in self.__candidates(key)):
+				return
+			self.collisions += 1
+			print("Pattern hash collision of {}, patterns are kept apart by codes".format(key))
+			self.__codes[key].append((canonicalCode, entry, {}))
+		else:
+			self.codeDict[key] = entry
+			self.__codes[key] = [(canonicalCode, entry, {})]
 
-		return inst
+	@staticmethod
+	def __packed(instString):
+		"""Packed code of @param instString of @method encode."""
+		if callable(instString):
+			instString = instString()
+		if isinstance(instString, np.ndarray):
+			return instString
+		return code_pack(instString)
 
 	def any_same(self, pattern):
 		"""check if any pattern is the same as the given pattern."""
-		if not tuple(pattern.code[0]) in self.codeDict:
+		key = pattern.canonical()[0]
+		if not key in self.codeDict:
 			return False
-		# pid = self.codeDict[tuple(pattern.code[0])][0]
-		# pattern1 = self.patternList[pid]
-		# return pattern1.is_same(pattern)
-		else:
-			return True
+		canonicalCode = pattern.canonical_code()
+		return any(np.array_equal(canonicalCode, c) for c, _, _ in self.__candidates(key))
 
 	def any_include(self, pattern):
 		"""
 		check if the given pattern is included by any pattern.
 		if True update the hierarchy infomation of the corresponding pattern.
+		Only patterns with as many instances as the given one and an instance
+		box around its first instance are checked, see @method include_update.
 		"""
-		for pattern1 in self.patternList:
-			if pattern1.is_include(pattern):
-				childP = pattern.childPatterns
-				if len(childP) > 0 and childP[0] not in pattern1.childPatterns:
-					# avoid including the same LR Pattern many times
-					pattern1.childPatterns.extend(pattern.childPatterns)  #included pattern can't be LR pattern
-				return True
-		return False
+		self.include_update()
+		if len(pattern) not in self.__includeIndex:
+			return False
+		tree, items = self.__includeIndex[len(pattern)]
+		box = pattern.instList[0].bbox
+		found = [items[i][0] for i in tree.intersection(box_tuple(box)) if box.inside(items[i][1].bbox)]
+		if not found:
+			return False
+		pattern1 = self.patternList[min(found)]		# the first one as scanning the list
+		childP = pattern.childPatterns
+		if len(childP) > 0 and childP[0] not in pattern1.childPatterns:
+			# avoid including the same LR Pattern many times
+			pattern1.childPatterns.extend(pattern.childPatterns)  #included pattern can't be LR pattern
+		return True
+
+	def include_update(self):
+		"""Index instance boxes of patterns appended to @member patternList since
+		last update, grouped by instance count. Indexed patterns should keep
+		their instances, the index is built again if the list is replaced."""
+		if self.__includeList is not self.patternList or self.__includeCount > len(self.patternList):
+			self.__includeIndex, self.__includeList, self.__includeCount = {}, self.patternList, 0
+		for position in range(self.__includeCount, len(self.patternList)):
+			pattern = self.patternList[position]
+			if len(pattern) not in self.__includeIndex:
+				self.__includeIndex[len(pattern)] = (index_build([]), [])
+			tree, items = self.__includeIndex[len(pattern)]
+			for inst in pattern.instList:
+				tree.insert(len(items), box_tuple(inst.bbox))
+				items.append((position, inst))
+		self.__includeCount = len(self.patternList)
 
 	def insert(self, pattern):
 		"""insert a existing pattern into the pattern library."""
 		# pattern.pid_update(self.patternCount)
 		self.patternList.append(pattern)
-		for i in range(len(pattern.code)):
-			x = pattern.code[i]
-			self.codeDict[ tuple(x) ] = [pattern.pid, TID(i+1)]
+		key, oidRef = pattern.canonical()
+		self.__register(key, pattern.canonical_code(), [pattern.pid, oidRef])
 		self.patternCount += 1
 
 	def remove(self, pattern):
@@ -752,12 +1331,18 @@ class PatternLib(object):
 		id = pattern.pid
 		# codeList = pattern.code
 		self.patternList.pop(id)     #pid is maintained
+		self.__includeList = None
 		# for i in range(id, self.patternCount):
 			# self.patternList[i].pid = i
 			# for code in codeList:
 				# self.codeDict.get(tuple(code))[0] = i
 
-	def pattern_rtree_construct(self):
-		"""Construct rtree for all patterns after library becomes stale."""
+	def pattern_rtree_construct(self, phase='pattern'):
+		"""Construct rtree for all patterns after library becomes stale, build
+		time and memory are reported as @param phase unless it is None."""
+		end, memory = time.time(), None if phase is None else memory_usage()
 		for pattern in self.patternList:
 			pattern.rtree_update()
+		if phase is not None:
+			index_report(phase, sum(len(p.instList) for p in self.patternList),
+						 time.time()-end, memory_usage()-memory)
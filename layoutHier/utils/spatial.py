@@ -0,0 +1,556 @@
+"""
+@version: 	0.2
+@brief:     Spatial index factory shared by all managers.
+Indexes are bulk loaded from all boxes at once instead of being filled one
+insert call at a time, and build time and memory are reported per phase.
+Queries: the interface of rtree.index.Index (intersection, nearest, insert),
+nearest item within a region, closure of a box, and batch forms of them.
+Backends: the libspatialindex rtree and a packed R-tree kept in NumPy arrays.
+Search windows of directional nearest queries are chosen per query by a
+window policy, fixed or sized from a coarse occupancy grid of the boxes.
+"""
+
+import os
+import math
+import time
+import resource
+
+import numpy as np
+from rtree import index
+
+__all__ = ["RtreeIndex", "PackedIndex", "index_build", "index_config", "index_report",
+			"indexBackends", "indexConfig", "indexStats", "memory_usage",
+			"FixedWindow", "DensityWindow", "window_build", "window_config",
+			"windowPolicies", "windowConfig"]
+
+# phase => [index count, item count, build time, memory in bytes]
+indexStats = {}
+# backend and node tuning used by index_build, None for defaults of the backend
+indexConfig = {'backend': 'rtree', 'leafCapacity': None, 'fillFactor': None}
+# search window policy used by window_build and its tuning, cell None for automatic
+windowConfig = {'policy': 'fixed', 'length': 200, 'target': 8, 'cell': None,
+				'minLength': 20, 'maxLength': 5000}
+
+
+def memory_usage():
+	"""Resident memory of the process in bytes."""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def index_report(phase, count, buildTime, memory, verbose=True):
+	"""Accumulate index building statistics of @param phase."""
+	stats = indexStats.setdefault(phase, [0, 0, 0.0, 0])
+	stats[0] += 1
+	stats[1] += count
+	stats[2] += buildTime
+	stats[3] += memory
+	if verbose:
+		print("Index build time of {} is {}, memory is {} KB, item count is {}".format(
+			phase, buildTime, memory//1024, count))
+
+def index_config(backend=None, leafCapacity=None, fillFactor=None):
+	"""Set the default backend ('rtree' or 'packed') and node tuning of index_build.
+	@param leafCapacity: maximal entries of one node.
+	@param fillFactor: ratio of leafCapacity filled by bulk loading."""
+	if backend is not None:
+		if backend not in indexBackends:
+			raise ValueError("Unknown index backend {}!".format(backend))
+		indexConfig['backend'] = backend
+	if leafCapacity is not None:
+		indexConfig['leafCapacity'] = leafCapacity
+	if fillFactor is not None:
+		if not 0 < fillFactor <= 1:
+			raise ValueError("Fill factor {} is out of (0, 1]!".format(fillFactor))
+		indexConfig['fillFactor'] = fillFactor
+
+def index_build(boxes, ids=None, phase=None, properties=None, backend=None):
+	"""Bulk load a spatial index of the configured backend.
+	@param boxes: (N, 4) array or list of (left, bottom, right, top).
+	@param ids: item ids, box i is indexed by i if None.
+	@param phase: name to report build time and memory with, None for silence,
+	when memory is not sampled either.
+	@param properties: index.Property for the rtree backend.
+	@param backend: 'rtree' or 'packed', indexConfig['backend'] if None."""
+	end, memory = time.time(), None if phase is None else memory_usage()
+	boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+	ids = np.arange(len(boxes)) if ids is None else np.asarray(ids, dtype=np.int64)
+	backend = indexConfig['backend'] if backend is None else backend
+	if backend not in indexBackends:
+		raise ValueError("Unknown index backend {}!".format(backend))
+	tree = indexBackends[backend].build(ids, boxes, indexConfig['leafCapacity'],
+										indexConfig['fillFactor'], properties)
+
+	if phase is not None:
+		index_report(phase, len(boxes), time.time()-end, memory_usage()-memory)
+	return tree
+
+
+def _queries(boxes):
+	"""Query boxes as a (Q, 4) float array, points are accepted as well."""
+	boxes = np.asarray(boxes, dtype=np.float64)
+	if boxes.size == 0:
+		return boxes.reshape(0, 4)
+	if boxes.ndim == 1:
+		boxes = boxes[None, :]
+	if boxes.shape[1] == 2:
+		boxes = np.hstack((boxes, boxes))
+	return boxes
+
+def _group_starts(q):
+	"""Start positions of runs of equal values in sorted @param q."""
+	return np.concatenate(([0], np.flatnonzero(np.diff(q)) + 1))
+
+def _box_distance(box, bar):
+	"""Squared euclidean distance between two boxes, 0 for intersecting ones."""
+	dx = max(0, box[0] - bar[2], bar[0] - box[2])
+	dy = max(0, box[1] - bar[3], bar[1] - box[3])
+	return dx*dx + dy*dy
+
+def _group_split(q, values, count):
+	"""Split @param values into @param count lists by sorted query index @param q."""
+	if count == 0:
+		return []
+	return [v.tolist() for v in np.split(values, np.searchsorted(q, np.arange(1, count)))]
+
+
+class RtreeIndex(index.Index):
+	"""The libspatialindex rtree with the batch queries of PackedIndex. Boxes
+	are kept in NumPy arrays as well for queries filtering items by their boxes,
+	which assume unique ids."""
+
+	@classmethod
+	def build(cls, ids, boxes, leafCapacity=None, fillFactor=None, properties=None):
+		"""Bulk load with STR packing of libspatialindex."""
+		if properties is None and (leafCapacity or fillFactor):
+			properties = index.Property()
+			if leafCapacity:
+				properties.leaf_capacity = properties.index_capacity = leafCapacity
+			if fillFactor:
+				properties.fill_factor = fillFactor
+		kwargs = {} if properties is None else {'properties': properties}
+		if len(boxes) == 0:
+			tree = cls(**kwargs)
+		else:
+			try:	# array interface of rtree >= 1.1
+				tree = cls((ids, boxes[:, :2], boxes[:, 2:]), **kwargs)
+			except (TypeError, AttributeError, ValueError):
+				stream = ((i, tuple(box), None) for i, box in zip(ids.tolist(), boxes.tolist()))
+				tree = cls(stream, **kwargs)
+		order = np.argsort(ids, kind='stable')
+		tree._ids, tree._bounds = ids[order], boxes[order]
+		tree._insertIds, tree._insertBounds = [], []
+		return tree
+
+	def insert(self, id, coordinates, obj=None):
+		"""Insert @param id with box @param coordinates, ids deleted before
+		should not be inserted again, since their boxes are kept for bounds."""
+		super().insert(id, coordinates, obj)
+		self._insertIds.append(id)
+		self._insertBounds.append(_queries(coordinates)[0])
+
+	def bounds(self, ids):
+		"""Boxes of items @param ids as an (N, 4) array."""
+		if self._insertIds:
+			ids0 = np.concatenate((self._ids, self._insertIds))
+			order = np.argsort(ids0, kind='stable')
+			self._ids = ids0[order]
+			self._bounds = np.vstack((self._bounds, self._insertBounds))[order]
+			self._insertIds, self._insertBounds = [], []
+		return self._bounds[np.searchsorted(self._ids, ids)]
+
+	def intersection_batch(self, boxes):
+		"""Ids intersecting with each of @param boxes."""
+		return [list(self.intersection(tuple(box))) for box in _queries(boxes).tolist()]
+
+	def nearest_batch(self, boxes, num_results=1):
+		"""Ids nearest to each of @param boxes, ties are included."""
+		return [list(self.nearest(tuple(box), num_results)) for box in _queries(boxes).tolist()]
+
+	def nearest_within(self, region, bar):
+		"""Id of the item nearest to @param bar among items intersecting with
+		@param region, None if there is no such item. Ties resolve to the first
+		item in intersection order."""
+		ids = list(self.intersection(region))
+		if not ids:
+			return None
+		bounds = self.bounds(ids)
+		distance = PackedIndex._distance(bounds, np.asarray([bar], dtype=np.float64))
+		return ids[int(np.argmin(distance))]
+
+	def nearest_within_batch(self, regions, bars):
+		"""nearest_within for each pair of @param regions and @param bars."""
+		return [self.nearest_within(region, bar) for region, bar in
+				zip(_queries(regions).tolist(), _queries(bars).tolist())]
+
+	def closure(self, box):
+		"""Smallest box containing @param box that every item intersecting with
+		it is inside. Items crossing the edges are merged until none is left."""
+		left, bottom, right, top = box
+		while True:
+			edges = ((left, top, right, top), (left, bottom, right, bottom),
+					 (left, bottom, left, top), (right, bottom, right, top))
+			ids = [i for edge in edges for i in self.intersection(edge)]
+			bounds = self.bounds(ids)
+			crossing = bounds[(bounds[:, 0] < left) | (bounds[:, 1] < bottom) |
+							  (bounds[:, 2] > right) | (bounds[:, 3] > top)]
+			if not len(crossing):
+				return (left, bottom, right, top)
+			left, bottom = min(left, crossing[:, 0].min()), min(bottom, crossing[:, 1].min())
+			right, top = max(right, crossing[:, 2].max()), max(top, crossing[:, 3].max())
+
+	def closure_batch(self, boxes):
+		"""closure for each of @param boxes."""
+		return [self.closure(box) for box in _queries(boxes).tolist()]
+
+
+class PackedIndex(object):
+	"""In-memory packed R-tree. Nodes of each level are sorted tile by tile (STR)
+	and cover a contiguous range of the level below, so one level is evaluated
+	for all candidate nodes of all query boxes by a few array operations.
+	Boxes inserted after building are scanned directly until they are packed,
+	and items deleted are masked out until then.
+	Intersections are sorted by id and nearest items by distance, ties of
+	nearest queries are included like rtree."""
+
+	def __init__(self, ids, boxes, leafCapacity=100, fillFactor=0.7):
+		self.fanout = max(2, int(leafCapacity*fillFactor))
+		self.__ids = np.asarray(ids, dtype=np.int64)
+		self.__boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		self.__pendingIds, self.__pendingBoxes = [], []
+		self.__alive, self.__positions, self.__deleted = None, None, 0
+		self.__pack()
+
+	@classmethod
+	def build(cls, ids, boxes, leafCapacity=None, fillFactor=None, properties=None):
+		return cls(ids, boxes, leafCapacity or 100, fillFactor or 0.7)
+
+	def __len__(self):
+		return len(self.__ids) + len(self.__pendingIds) - self.__deleted
+
+	def __pack(self):
+		"""Build the levels from leaves up to the root, root level first."""
+		if self.__deleted:
+			self.__ids, self.__boxes = self.__ids[self.__alive], self.__boxes[self.__alive]
+		if self.__pendingIds:
+			self.__ids = np.concatenate((self.__ids, self.__pendingIds))
+			self.__boxes = np.vstack((self.__boxes, self.__pendingBoxes))
+			self.__pendingIds, self.__pendingBoxes = [], []
+		order = PackedIndex._str_order(self.__boxes, self.fanout)
+		self.__ids, self.__boxes = self.__ids[order], self.__boxes[order]
+		self.__alive = np.ones(len(self.__ids), dtype=bool)
+		self.__positions, self.__deleted = None, 0
+
+		self.__levels = []	# (node boxes, child starts, child ends)
+		boxes = self.__boxes
+		while len(boxes) > self.fanout:
+			starts = np.arange(0, len(boxes), self.fanout)
+			ends = np.minimum(starts + self.fanout, len(boxes))
+			nodes = np.hstack((np.minimum.reduceat(boxes[:, :2], starts),
+							   np.maximum.reduceat(boxes[:, 2:], starts)))
+			order = PackedIndex._str_order(nodes, self.fanout)
+			boxes = nodes[order]
+			self.__levels.append((boxes, starts[order], ends[order]))
+		self.__levels.reverse()
+
+	@staticmethod
+	def _str_order(boxes, fanout):
+		"""Sort-tile-recursive order: vertical slices by center x, than center y."""
+		count = len(boxes)
+		centers = boxes[:, :2] + boxes[:, 2:]
+		slices = int(math.ceil(math.sqrt(math.ceil(count/fanout))))
+		byX = np.argsort(centers[:, 0], kind='stable')
+		tile = np.empty(count, dtype=np.int64)
+		tile[byX] = np.arange(count)//max(1, slices*fanout)
+		return np.lexsort((centers[:, 1], tile))
+
+	@staticmethod
+	def _expand(q, starts, ends):
+		"""Pairs of query index and child position for children of given nodes."""
+		counts = ends - starts
+		offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+		return np.repeat(q, counts), np.arange(counts.sum()) + offsets
+
+	@staticmethod
+	def _overlap(boxes, queries):
+		return (boxes[:, 0] <= queries[:, 2]) & (queries[:, 0] <= boxes[:, 2]) & \
+			   (boxes[:, 1] <= queries[:, 3]) & (queries[:, 1] <= boxes[:, 3])
+
+	@staticmethod
+	def _distance(boxes, queries):
+		"""Squared euclidean distance between boxes, 0 for intersecting ones."""
+		dx = np.maximum(0, np.maximum(queries[:, 0] - boxes[:, 2], boxes[:, 0] - queries[:, 2]))
+		dy = np.maximum(0, np.maximum(queries[:, 1] - boxes[:, 3], boxes[:, 1] - queries[:, 3]))
+		return dx*dx + dy*dy
+
+	def __roots(self, count):
+		"""Pairs of query index and every top node (or item for tiny indexes)."""
+		top = len(self.__levels[0][0]) if self.__levels else len(self.__ids)
+		return np.repeat(np.arange(count), top), np.tile(np.arange(top), count)
+
+	def __candidates(self, queries):
+		"""Pairs of query index and id intersecting with @param queries."""
+		q, n = self.__roots(len(queries))
+		for nodes, starts, ends in self.__levels:
+			hit = PackedIndex._overlap(nodes[n], queries[q])
+			q, n = PackedIndex._expand(q[hit], starts[n[hit]], ends[n[hit]])
+		hit = PackedIndex._overlap(self.__boxes[n], queries[q])
+		if self.__deleted:
+			hit &= self.__alive[n]
+		q, ids, boxes = q[hit], self.__ids[n[hit]], self.__boxes[n[hit]]
+		if self.__pendingIds:
+			pq = np.repeat(np.arange(len(queries)), len(self.__pendingIds))
+			pn = np.tile(np.arange(len(self.__pendingIds)), len(queries))
+			pendingBoxes = np.asarray(self.__pendingBoxes)[pn]
+			hit = PackedIndex._overlap(pendingBoxes, queries[pq])
+			q = np.concatenate((q, pq[hit]))
+			ids = np.concatenate((ids, np.asarray(self.__pendingIds)[pn[hit]]))
+			boxes = np.vstack((boxes, pendingBoxes[hit]))
+		return q, ids, boxes
+
+	def __bound(self, queries, num_results):
+		"""Squared distance that the nearest @param num_results items are within,
+		found by descending to the closest node of each level."""
+		count = len(queries)
+		if len(self.__ids) == 0 or count == 0:
+			return np.full(count, np.inf)
+		q, n = self.__roots(count)
+		for nodes, starts, ends in self.__levels:
+			d = PackedIndex._distance(nodes[n], queries[q])
+			order = np.lexsort((d, q))
+			n = n[order[_group_starts(q[order])]]
+			q, n = PackedIndex._expand(np.arange(count), starts[n], ends[n])
+		d = PackedIndex._distance(self.__boxes[n], queries[q])
+		if self.__deleted:
+			d[~self.__alive[n]] = np.inf
+		groups = _group_starts(q)
+		if num_results == 1:
+			return np.minimum.reduceat(d, groups)
+		bound = np.maximum.reduceat(d, groups)
+		bound[np.diff(np.append(groups, len(q))) < num_results] = np.inf
+		return bound
+
+	def insert(self, id, coordinates):
+		"""Insert @param id with box @param coordinates, the index is packed
+		again once unpacked boxes become too many."""
+		self.__pendingIds.append(id)
+		self.__pendingBoxes.append(_queries(coordinates)[0].tolist())
+		if len(self.__pendingIds) > max(self.fanout, len(self.__ids)//8):
+			self.__pack()
+
+	def delete(self, id, coordinates):
+		"""Delete @param id with box @param coordinates, the index is packed
+		again once deleted items become too many."""
+		if id in self.__pendingIds:
+			i = self.__pendingIds.index(id)
+			del self.__pendingIds[i], self.__pendingBoxes[i]
+			return
+		if self.__positions is None:
+			self.__positions = dict(zip(self.__ids.tolist(), range(len(self.__ids))))
+		position = self.__positions.pop(id, None)
+		if position is None:
+			return
+		self.__alive[position] = False
+		self.__deleted += 1
+		if self.__deleted > max(self.fanout, len(self.__ids)//8):
+			self.__pack()
+
+	def intersection_batch(self, boxes):
+		"""Ids intersecting with each of @param boxes."""
+		queries = _queries(boxes)
+		q, ids, _ = self.__candidates(queries)
+		order = np.lexsort((ids, q))
+		return _group_split(q[order], ids[order], len(queries))
+
+	def nearest_batch(self, boxes, num_results=1):
+		"""Ids nearest to each of @param boxes, ties are included."""
+		queries = _queries(boxes)
+		bound = self.__bound(queries, num_results)
+		radius = np.sqrt(bound)*(1 + 1e-12) + 1e-9
+		q, ids, found = self.__candidates(queries + np.stack((-radius, -radius, radius, radius), axis=1))
+		d = PackedIndex._distance(found, queries[q])
+		order = np.lexsort((ids, d, q))
+		q, ids, d = q[order], ids[order], d[order]
+		if len(q):
+			groups = _group_starts(q)
+			counts = np.diff(np.append(groups, len(q)))
+			kth = d[groups + np.minimum(counts, num_results) - 1]
+			keep = d <= np.repeat(kth, counts)
+			q, ids = q[keep], ids[keep]
+		return _group_split(q, ids, len(queries))
+
+	def nearest_within_batch(self, regions, bars):
+		"""Id of the item nearest to each of @param bars among items intersecting
+		with the corresponding region of @param regions, None if there is no
+		such item. Ties resolve to the smallest id."""
+		regions, bars = _queries(regions), _queries(bars)
+		q, ids, boxes = self.__candidates(regions)
+		d = PackedIndex._distance(boxes, bars[q])
+		order = np.lexsort((ids, d, q))
+		q, ids = q[order], ids[order]
+		nearest = [None]*len(regions)
+		if len(q):
+			first = _group_starts(q)
+			for i, id in zip(q[first].tolist(), ids[first].tolist()):
+				nearest[i] = id
+		return nearest
+
+	def closure_batch(self, boxes):
+		"""Smallest box containing each of @param boxes that every item
+		intersecting with it is inside. All seeds are grown together, one
+		round merges every item crossing the boxes still growing."""
+		boxes = _queries(boxes).copy()
+		active = np.arange(len(boxes))
+		while len(active):
+			q, _, found = self.__candidates(boxes[active])
+			seeds = boxes[active][q]
+			crossing = (found[:, 0] < seeds[:, 0]) | (found[:, 1] < seeds[:, 1]) | \
+					   (found[:, 2] > seeds[:, 2]) | (found[:, 3] > seeds[:, 3])
+			q, found = q[crossing], found[crossing]
+			if not len(q):
+				break
+			order = np.argsort(q, kind='stable')
+			q, found = q[order], found[order]
+			groups = _group_starts(q)
+			active = active[q[groups]]
+			boxes[active, :2] = np.minimum(boxes[active, :2], np.minimum.reduceat(found[:, :2], groups))
+			boxes[active, 2:] = np.maximum(boxes[active, 2:], np.maximum.reduceat(found[:, 2:], groups))
+		return [tuple(box) for box in boxes.tolist()]
+
+	def intersection(self, coordinates):
+		return self.intersection_batch(coordinates)[0]
+
+	def closure(self, box):
+		return self.closure_batch(box)[0]
+
+	def nearest_within(self, region, bar):
+		return self.nearest_within_batch(region, bar)[0]
+
+	def nearest(self, coordinates, num_results=1):
+		return self.nearest_batch(coordinates, num_results)[0]
+
+	def count(self, coordinates):
+		return len(self.intersection(coordinates))
+
+
+indexBackends = {'rtree': RtreeIndex, 'packed': PackedIndex}
+
+
+def window_config(policy=None, **kwargs):
+	"""Set the default policy ('fixed' or 'density') of window_build and its
+	tuning, keywords are those of windowConfig."""
+	if policy is not None:
+		if policy not in windowPolicies:
+			raise ValueError("Unknown window policy {}!".format(policy))
+		windowConfig['policy'] = policy
+	for key, value in kwargs.items():
+		if key not in windowConfig or key == 'policy':
+			raise ValueError("Unknown window option {}!".format(key))
+		windowConfig[key] = value
+	if not 0 < windowConfig['minLength'] <= windowConfig['maxLength']:
+		raise ValueError("Window lengths {} are not ordered!".format(
+			(windowConfig['minLength'], windowConfig['maxLength'])))
+
+def window_build(boxes, policy=None):
+	"""Build a search window policy of the configured kind over @param boxes,
+	(N, 4) array or list of (left, bottom, right, top).
+	@param policy: 'fixed' or 'density', windowConfig['policy'] if None."""
+	policy = windowConfig['policy'] if policy is None else policy
+	if policy not in windowPolicies:
+		raise ValueError("Unknown window policy {}!".format(policy))
+	return windowPolicies[policy].build(np.asarray(boxes, dtype=np.float64).reshape(-1, 4), windowConfig)
+
+
+class FixedWindow(object):
+	"""Search window of the same length for every query."""
+
+	def __init__(self, length=200):
+		self.length = length
+
+	@classmethod
+	def build(cls, boxes, config):
+		return cls(config['length'])
+
+	def lengths(self, boxes):
+		"""(horizontal, vertical) window lengths of each of @param boxes."""
+		return [(self.length, self.length)]*len(boxes)
+
+	def __repr__(self):
+		return "FixedWindow({})".format(self.length)
+
+
+class DensityWindow(object):
+	"""Search window sized by the local density of items, so that a window is
+	expected to hold @param target items on sparse and dense regions alike.
+	Density around a query is read from a coarse occupancy grid counting item
+	centers, averaged over the 3x3 cells around the center of the query."""
+
+	def __init__(self, counts, origin, cell, itemSize, target=8, minLength=20, maxLength=5000):
+		"""
+		@param counts: (X, Y) array of item centers in each grid cell.
+		@param origin: (x, y) of the lower left corner of the grid.
+		@param cell: side length of grid cells.
+		@param itemSize: mean (width, height) of items.
+		@param minLength, maxLength: bounds of window lengths."""
+		self.origin = np.asarray(origin, dtype=np.float64)
+		self.cell = cell
+		self.itemSize = itemSize
+		self.target = target
+		self.minLength, self.maxLength = minLength, maxLength
+		self.shape = counts.shape
+		# summed area table, counts of cells [0, i) x [0, j) at [i, j]
+		self.__sums = np.zeros((counts.shape[0]+1, counts.shape[1]+1))
+		self.__sums[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+
+	@classmethod
+	def build(cls, boxes, config):
+		"""Grid cells hold config['target'] items on average unless
+		config['cell'] is given."""
+		target = config['target']
+		kwargs = {'target': target, 'minLength': config['minLength'], 'maxLength': config['maxLength']}
+		if len(boxes) == 0:
+			return cls(np.zeros((1, 1)), (0, 0), config['cell'] or 1, (0, 0), **kwargs)
+		centers = (boxes[:, :2] + boxes[:, 2:])/2
+		origin = centers.min(axis=0)
+		extent = centers.max(axis=0) - origin + 1
+		cell = config['cell'] or max(1.0, math.sqrt(extent[0]*extent[1]*target/len(boxes)))
+		cells = ((centers - origin)//cell).astype(np.int64)
+		shape = cells.max(axis=0) + 1
+		counts = np.bincount(cells[:, 0]*shape[1] + cells[:, 1], minlength=shape[0]*shape[1])
+		itemSize = tuple((boxes[:, 2:] - boxes[:, :2]).mean(axis=0).tolist())
+		return cls(counts.reshape(shape), origin, cell, itemSize, **kwargs)
+
+	def density(self, boxes):
+		"""Items per unit area around the center of each of @param boxes."""
+		boxes = _queries(boxes)
+		cells = ((boxes[:, :2] + boxes[:, 2:])/2 - self.origin)//self.cell
+		lo = np.clip(cells - 1, 0, np.array(self.shape) - 1).astype(np.int64)
+		hi = np.clip(cells + 2, 1, np.array(self.shape)).astype(np.int64)
+		hi = np.maximum(hi, lo + 1)
+		sums = self.__sums
+		count = sums[hi[:, 0], hi[:, 1]] - sums[lo[:, 0], hi[:, 1]] - sums[hi[:, 0], lo[:, 1]] + sums[lo[:, 0], lo[:, 1]]
+		return count/((hi - lo).prod(axis=1)*self.cell*self.cell)
+
+	def lengths(self, boxes):
+		"""(horizontal, vertical) window lengths of each of @param boxes. An
+		item intersects a window of length L beside a side of length s when
+		its center lies in (L + item width) x (s + item height), and L is
+		solved so that this region holds target items."""
+		boxes = _queries(boxes)
+		if len(boxes) == 0:
+			return []
+		density = np.maximum(self.density(boxes), 1e-12)
+		width, height = self.itemSize
+		horizontal = self.target/(density*(boxes[:, 3] - boxes[:, 1] + height)) - width
+		vertical = self.target/(density*(boxes[:, 2] - boxes[:, 0] + width)) - height
+		lengths = np.clip(np.column_stack((horizontal, vertical)), self.minLength, self.maxLength)
+		return [tuple(length) for length in np.ceil(lengths).astype(np.int64).tolist()]
+
+	def __repr__(self):
+		return "DensityWindow(grid {}x{}, cell {:.0f}, target {})".format(
+			self.shape[0], self.shape[1], self.cell, self.target)
+
+
+windowPolicies = {'fixed': FixedWindow, 'density': DensityWindow}
@@ -13,7 +13,8 @@ setup(
     dependencies = [
     'klayout >= 0.26.0',
     'Rtree >= 0.8.3',
-    'bintrees >= 2.0.7'
+    'bintrees >= 2.0.7',
+    'numpy >= 1.16.0'
     ],
     classifiers = [
     'Topic :: Software Development :: Electronic Design Automation',